@@ -1,32 +1,31 @@
+from util.startup import startupTimer
 import ctypes
 import glob
 import os
 import platform
-import shutil
 from functools import partial
-import qdarkstyle
 
 this_file = os.path.realpath(__file__)
 wd = os.path.dirname(this_file)
 if os.getcwd() != wd:
     os.chdir(wd)
-if not os.path.isfile("config.py"):
-    open("config.py", "a", encoding="utf-8").close()
 from configDefault import *
-import re, sqlite3, webbrowser, sys, pprint
+startupTimer.mark("config")
+import re, webbrowser, sys, threading
 from shutil import copyfile
 from datetime import datetime
-from util.worker import ChatGPTResponse
-from PySide6.QtPrintSupport import QPrinter, QPrintDialog
-from PySide6.QtCore import Qt, QRegularExpression
+from util.futures import FutureSignals
+from util.database import DatabaseService, splitTranscript, joinTranscript
+from util.context import ContextBuilder
+from util.qtrefs import topUp
+from PySide6.QtCore import Qt, QRegularExpression, QTimer, QAbstractListModel, QModelIndex
 from PySide6.QtGui import (
-    QStandardItemModel,
-    QStandardItem,
     QGuiApplication,
     QAction,
     QIcon,
     QFontMetrics,
     QTextDocument,
+    QTextCursor,
 )
 from PySide6.QtWidgets import (
     QCompleter,
@@ -49,69 +48,161 @@ from PySide6.QtWidgets import (
     QLineEdit,
     QSplitter,
     QComboBox,
+    QDockWidget,
 )
-
-
-class Database:
-    def __init__(self, filePath=""):
-        def regexp(expr, item):
-            reg = re.compile(expr, flags=re.IGNORECASE)
-            return reg.search(item) is not None
-
-        defaultFilePath = (
-            config.chatGPTApiLastChatDatabase
-            if config.chatGPTApiLastChatDatabase
-            and os.path.isfile(config.chatGPTApiLastChatDatabase)
-            else os.path.join(wd, "chats", "default.chat")
-        )
-        self.filePath = filePath if filePath else defaultFilePath
-        self.connection = sqlite3.connect(self.filePath)
-        self.connection.create_function("REGEXP", 2, regexp)
-        self.cursor = self.connection.cursor()
-        self.cursor.execute(
-            "CREATE TABLE IF NOT EXISTS data (id TEXT PRIMARY KEY, title TEXT, content TEXT)"
-        )
-        self.connection.commit()
-
-    def insert(self, id, title, content):
-        self.cursor.execute("SELECT * FROM data WHERE id = ?", (id,))
-        existing_data = self.cursor.fetchone()
-        if existing_data:
-            if existing_data[1] == title and existing_data[2] == content:
-                return
+startupTimer.mark("imports")
+
+
+def getChatGPTResponse():
+    # the chat backend brings in the HTTP stack, which the first window does not need
+    if config.chatBackend == "asyncio":
+        from util.asyncworker import AsyncChatGPTResponse as ChatGPTResponse
+    else:
+        from util.worker import ChatGPTResponse
+    return ChatGPTResponse
+
+
+def preloadChatBackend():
+    # imported on a background thread after the first paint, so the first
+    # prompt does not pay for it either
+    threading.Thread(target=getChatGPTResponse, daemon=True).start()
+
+
+class ConversationListModel(QAbstractListModel):
+    '''
+    Conversation titles, newest first, loaded a page at a time.
+
+    Only ids and titles are held; the view asks for the next page through
+    canFetchMore/fetchMore as it scrolls. Rows carry (id, title) in
+    Qt.UserRole and the id as their tooltip. Saves and deletes reported by
+    the database touch just the affected row.
+
+    The database is a DatabaseService: pages and change notifications come
+    back from its thread and are applied on the GUI thread, in the order
+    the service produced them.
+    '''
+    pageSize = 200
+
+    def __init__(self, database, parent=None):
+        super().__init__(parent)
+        self.database = None
+        self.listener = None
+        self.rows = []
+        self.exhausted = False
+        self.fetching = False
+        self.generation = 0
+        self.signals = FutureSignals(self)
+        self.signals.error.connect(self.fetchFailed)
+        self.setDatabase(database)
+
+    def setDatabase(self, database):
+        self.beginResetModel()
+        if self.listener in getattr(self.database, "listeners", ()):
+            self.database.listeners.remove(self.listener)
+        self.database = database
+        # runs on the service thread; hand the change over to the GUI thread
+        self.listener = lambda *change: self.signals.call(self.changedIn, database, change)
+        self.database.listeners.append(self.listener)
+        self.rows = []
+        self.exhausted = False
+        self.fetching = False
+        # pages requested before a reset are dropped when they arrive
+        self.generation += 1
+        self.endResetModel()
+
+    def changedIn(self, database, change):
+        # drop what a database replaced in the meantime still had queued
+        if database is self.database:
+            self.databaseChanged(*change)
+
+    def findRow(self, id):
+        # rows are sorted by id, newest first; first row whose id is not newer than id
+        low, high = 0, len(self.rows)
+        while low < high:
+            middle = (low + high) // 2
+            if self.rows[middle][0] > id:
+                low = middle + 1
             else:
-                self.cursor.execute(
-                    "UPDATE data SET title = ?, content = ? WHERE id = ?",
-                    (title, content, id),
-                )
-                self.connection.commit()
-        else:
-            self.cursor.execute(
-                "INSERT INTO data (id, title, content) VALUES (?, ?, ?)",
-                (id, title, content),
-            )
-            self.connection.commit()
-
-    def search(self, title, content):
-        if config.regexpSearchEnabled:
-            self.cursor.execute(
-                "SELECT * FROM data WHERE title REGEXP ? AND content REGEXP ?",
-                (title, content),
-            )
-        else:
-            self.cursor.execute(
-                "SELECT * FROM data WHERE title LIKE ? AND content LIKE ?",
-                ("%{}%".format(title), "%{}%".format(content)),
-            )
-        return self.cursor.fetchall()
-
-    def delete(self, id):
-        self.cursor.execute("DELETE FROM data WHERE id = ?", (id,))
-        self.connection.commit()
-
-    def clear(self):
-        self.cursor.execute("DELETE FROM data")
-        self.connection.commit()
+                high = middle
+        return low
+
+    def databaseChanged(self, event, *args):
+        if event == "saved":
+            id, title = args
+            row = self.findRow(id)
+            if row < len(self.rows) and self.rows[row][0] == id:
+                self.rows[row] = (id, title)
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+            elif row < len(self.rows) or self.exhausted:
+                # past the loaded pages it will arrive with a later fetchMore
+                self.beginInsertRows(QModelIndex(), row, row)
+                self.rows.insert(row, (id, title))
+                self.endInsertRows()
+        elif event == "deleted":
+            for id in args[0]:
+                row = self.findRow(id)
+                if row < len(self.rows) and self.rows[row][0] == id:
+                    self.beginRemoveRows(QModelIndex(), row, row)
+                    del self.rows[row]
+                    self.endRemoveRows()
+        elif event == "cleared":
+            self.beginResetModel()
+            self.rows = []
+            self.exhausted = True
+            self.endResetModel()
+        elif event == "imported":
+            # too many rows to place one by one; page them in again
+            self.beginResetModel()
+            self.rows = []
+            self.exhausted = False
+            self.fetching = False
+            self.generation += 1
+            self.endResetModel()
+            self.fetchMore()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        id, title = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return title
+        if role == Qt.ToolTipRole:
+            return id
+        if role == Qt.UserRole:
+            return (id, title)
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted or self.fetching:
+            return
+        self.fetching = True
+        before = self.rows[-1][0] if self.rows else None
+        future = self.database.submit("listConversations", before, self.pageSize)
+        self.signals.then(future, partial(self.pageFetched, self.generation))
+
+    def fetchFailed(self, error):
+        # the history phase is over even without a page; startup must not wait for one
+        startupTimer.mark("history loaded")
+        self.fetching = False
+
+    def pageFetched(self, generation, page):
+        if generation != self.generation:
+            return
+        startupTimer.mark("history loaded")
+        self.fetching = False
+        if len(page) < self.pageSize:
+            self.exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
 
 
 class QChatGpt(QWidget):
@@ -135,10 +226,7 @@ class QChatGpt(QWidget):
             "ChatGPT-GUI Database (*.chat)",
             options=options,
         )
-        self.database = Database(filePath)
-        self.loadData()
-        self.updateTitle(filePath)
-        self.newData()
+        self.switchDatabase(filePath)
 
     def newDatabase(self, copyExistingDatabase=False):
         options = QFileDialog.Options()
@@ -174,11 +262,18 @@ class QChatGpt(QWidget):
                 else:
                     os.remove(filePath)
             if copyExistingDatabase:
-                shutil.copy(self.database.filePath, filePath)
-            self.database = Database(filePath)
-            self.loadData()
-            self.updateTitle(filePath)
-            self.newData()
+                future = self.database.submit("backup", filePath)
+                self.signals.then(future, lambda _: self.switchDatabase(filePath))
+            else:
+                self.switchDatabase(filePath)
+
+    def switchDatabase(self, filePath):
+        # closing waits for the writes still queued for the old file
+        self.database.close()
+        self.database = DatabaseService(filePath)
+        self.loadData()
+        self.updateTitle(self.database.filePath)
+        self.newData()
 
     def updateTitle(self, filePath=""):
         if not filePath:
@@ -189,10 +284,21 @@ class QChatGpt(QWidget):
 
     def setupVariables(self):
         self.busyLoading = False
+        # appends arriving in the same event loop pass share one scroll update
+        self.scrollTimer = QTimer(self)
+        self.scrollTimer.setSingleShot(True)
+        self.scrollTimer.setInterval(0)
+        self.scrollTimer.timeout.connect(self.doScrollToEnd)
+        self.currentWorker = None
         self.contentID = ""
-        self.database = Database()
+        # selected conversation whose messages are still being read
+        self.pendingID = ""
+        self.signals = FutureSignals(self)
+        self.contextBuilder = ContextBuilder(
+            config.chatGPTApiMaxTokens, config.chatGPTApiContextStrategy
+        )
+        self.database = DatabaseService()
         self.updateTitle()
-        self.data_list = []
 
     def setupUI(self):
         layout000 = QHBoxLayout()
@@ -219,6 +325,8 @@ class QChatGpt(QWidget):
         )
         self.contentView = QPlainTextEdit()
         self.contentView.setReadOnly(True)
+        # transcripts only ever grow at the end; an undo stack would keep a copy of every chunk
+        self.contentView.setUndoRedoEnabled(False)
         self.progressBar = QProgressBar()
         self.progressBar.setRange(0, 0)
         self.multilineButton = QPushButton("+")
@@ -252,7 +360,7 @@ class QChatGpt(QWidget):
         rtButtonLayout.addWidget(saveButton)
         helpButton = QPushButton(config.thisTranslation["help"])
         self.listView = QListView()
-        self.listModel = QStandardItemModel()
+        self.listModel = ConversationListModel(self.database, self)
         self.listView.setModel(self.listModel)
         removeButton = QPushButton(config.thisTranslation["remove"])
         clearAllButton = QPushButton(config.thisTranslation["clearAll"])
@@ -322,8 +430,7 @@ class QChatGpt(QWidget):
         if confirm == QMessageBox.Yes:
             item = index[0]
             data = item.data(Qt.UserRole)
-            self.database.delete(data[0])
-            self.loadData()
+            self.database.submit("delete", data[0])
             self.newData()
 
     def clearData(self):
@@ -335,8 +442,10 @@ class QChatGpt(QWidget):
             QMessageBox.No,
         )
         if confirm == QMessageBox.Yes:
-            self.database.clear()
-            self.loadData()
+            self.database.submit("clear")
+            # the transcript on screen is no longer stored; appending the next
+            # turn would store only that turn, so the whole text is saved instead
+            self.contentID = self.pendingID = self.currentLoadingID = ""
 
     def saveData(self):
         text = self.contentView.toPlainText().strip()
@@ -346,34 +455,51 @@ class QChatGpt(QWidget):
                 self.contentID = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
             title = re.sub("^>>> ", "", lines[0][:50])
             content = text
-            self.database.insert(self.contentID, title, content)
-            self.loadData()
+            self.database.submit("insert", self.contentID, title, content)
+
+    def saveMessage(self, role, text):
+        # once a conversation is stored, a turn only appends its own message;
+        # text edited by hand still needs the whole transcript saved
+        tokens = self.contextBuilder.add(role, text)
+        if not self.contentID or self.editableCheckbox.isChecked():
+            self.saveData()
+        else:
+            firstLine = self.contentView.document().firstBlock().text()
+            title = re.sub("^>>> ", "", firstLine[:50])
+            self.database.submit("appendMessage", self.contentID, title, role, text, tokens)
 
     def loadData(self):
-        self.data_list = self.database.search("", "")
-        if self.data_list:
-            self.data_list.reverse()
-        self.listModel.clear()
-        for data in self.data_list:
-            item = QStandardItem(data[1])
-            item.setToolTip(data[0])
-            item.setData(data, Qt.UserRole)
-            self.listModel.appendRow(item)
+        # only the first page is read now; the view fetches more as it scrolls
+        self.listModel.setDatabase(self.database)
+        self.listModel.fetchMore()
 
     def newData(self):
         if not self.busyLoading:
-            self.contentID = ""
+            self.contentID = self.pendingID = ""
             self.setUserInputFocus()
 
     def selectData(self, index):
         if not self.busyLoading:
             data = index.data(Qt.UserRole)
-            self.contentID = data[0]
-            content = data[2]
-            self.contentView.setPlainText(content)
+            # contentID follows only once the messages are shown, so that
+            # until then sending and saving still go with the text on screen
+            self.pendingID = data[0]
+            future = self.database.submit("getMessages", data[0])
+            self.signals.then(future, partial(self.showContent, data[0]))
             self.setUserInputFocus()
 
+    def showContent(self, id, messages):
+        # another conversation may have been selected while this one loaded
+        if id == self.pendingID and not self.busyLoading:
+            self.contentID = id
+            self.pendingID = ""
+            self.contentView.setPlainText(joinTranscript(message[:2] for message in messages))
+            # stored token counts come along, so nothing is counted again
+            self.contextBuilder.reset(messages)
+
     def printData(self):
+        from PySide6.QtPrintSupport import QPrinter, QPrintDialog
+
         printer = QPrinter()
         dialog = QPrintDialog(printer, self)
         if dialog.exec() == QPrintDialog.Accepted:
@@ -382,34 +508,58 @@ class QChatGpt(QWidget):
             document.print_(printer)
 
     def getContext(self):
-        if not config.chatGPTApiPredefinedContext in config.predefinedContexts:
-            config.chatGPTApiPredefinedContext = "[none]"
-        if config.chatGPTApiPredefinedContext == "[none]":
-            context = ""
-        elif config.chatGPTApiPredefinedContext == "[custom]":
-            context = config.chatGPTApiContext
-        else:
-            context = config.predefinedContexts[config.chatGPTApiPredefinedContext]
-        return context
+        from util.backend import getContext
+
+        return getContext()
 
     def getMessages(self, userInput):
-        return userInput
+        builder = self.contextBuilder
+        builder.maxTokens = config.chatGPTApiMaxTokens
+        builder.strategy = config.chatGPTApiContextStrategy
+        if not self.contentID or self.editableCheckbox.isChecked():
+            # the transcript on screen becomes the history; only here is it counted whole
+            builder.reset(splitTranscript(self.contentView.toPlainText().strip()))
+        return builder.build(userInput, self.getContext(), config.chatGPTApiContextInAllInputs)
 
     def print(self, text):
-        self.contentView.appendPlainText(
-            f"\n{text}" if self.contentView.toPlainText() else text
-        )
-        self.contentView.setPlainText(
-            re.sub("\n\n[\n]+?([^\n])", "\\n\\n\\1", self.contentView.toPlainText())
-        )
+        if not self.contentView.document().isEmpty():
+            text = f"\n\n{text}"
+        self.appendText(text, normalize=True)
 
     def printStream(self, text):
         for t in config.chatGPTTransformers:
             text = t(text)
-        self.contentView.setPlainText(self.contentView.toPlainText() + text)
+        self.appendText(text)
+
+    def trailingNewlines(self):
+        # count empty blocks at the end; only as deep as the trailing blank lines go
+        count = 0
+        block = self.contentView.document().lastBlock()
+        while block.isValid() and not block.text() and block.previous().isValid():
+            count += 1
+            block = block.previous()
+        return count
+
+    def appendText(self, text, normalize=False):
+        cursor = QTextCursor(self.contentView.document())
+        cursor.movePosition(QTextCursor.End)
+        if normalize:
+            # collapse runs of blank lines, but only across the old tail and the new text
+            trailing = self.trailingNewlines()
+            text = re.sub("\n\n[\n]+?([^\n])", "\\n\\n\\1", "\n" * trailing + text)
+            if trailing:
+                cursor.movePosition(QTextCursor.Left, QTextCursor.KeepAnchor, trailing)
+        cursor.insertText(text)
         if config.chatGPTApiAutoScrolling:
-            contentScrollBar = self.contentView.verticalScrollBar()
-            contentScrollBar.setValue(contentScrollBar.maximum())
+            self.scrollToEnd()
+
+    def scrollToEnd(self):
+        if not self.scrollTimer.isActive():
+            self.scrollTimer.start()
+
+    def doScrollToEnd(self):
+        contentScrollBar = self.contentView.verticalScrollBar()
+        contentScrollBar.setValue(contentScrollBar.maximum())
 
     def sendMessage(self):
         if self.userInputMultiline.isVisible():
@@ -418,9 +568,8 @@ class QChatGpt(QWidget):
 
     def getResponse(self):
         if self.progressBar.isVisible() and config.chatGPTApiNoOfChoices == 1:
-            stop_file = ".stop_chatgpt"
-            if not os.path.isfile(stop_file):
-                open(stop_file, "a", encoding="utf-8").close()
+            if self.currentWorker is not None:
+                self.currentWorker.cancel()
         elif not self.progressBar.isVisible():
             userInput = self.userInput.text().strip()
             if userInput:
@@ -430,13 +579,18 @@ class QChatGpt(QWidget):
                     self.busyLoading = True
                     self.listView.setDisabled(True)
                     self.newButton.setDisabled(True)
+                # the reply continues the conversation on screen, not one still loading
+                self.pendingID = ""
                 messages = self.getMessages(userInput)
                 self.print(f">>> {userInput}")
-                self.saveData()
+                self.saveMessage("user", userInput)
                 self.currentLoadingID = self.contentID
                 self.currentLoadingContent = self.contentView.toPlainText().strip()
                 self.progressBar.show()
-                ChatGPTResponse(self).workOnGetResponse(messages)
+                if config.chatGPTApiStream:
+                    # streamed chunks start on their own line, like print() does
+                    self.contentView.appendPlainText("")
+                self.currentWorker = getChatGPTResponse()(self).workOnGetResponse(messages)
 
     def fileNamesWithoutExtension(self, dir, ext):
         files = glob.glob(os.path.join(dir, "*.{0}".format(ext)))
@@ -448,17 +602,21 @@ class QChatGpt(QWidget):
             ]
         )
 
+    def processError(self, error):
+        # keep whatever was streamed before the failure, then unlock the UI
+        exctype, value, _ = error
+        QMessageBox.warning(self, "ChatGPT-GUI", f"{exctype.__name__}: {value}")
+        self.processResponse("")
+
     def processResponse(self, responses):
+        self.currentWorker = None
         if responses:
             self.contentID = self.currentLoadingID
             self.contentView.setPlainText(self.currentLoadingContent)
             self.currentLoadingID = self.currentLoadingContent = ""
             self.print(responses)
-            if config.chatGPTApiAutoScrolling:
-                contentScrollBar = self.contentView.verticalScrollBar()
-                contentScrollBar.setValue(contentScrollBar.maximum())
+            self.saveMessage("assistant", responses)
         self.userInput.setText("")
-        self.saveData()
         self.userInput.setEnabled(True)
         if config.chatGPTApiNoOfChoices == 1:
             self.listView.setEnabled(True)
@@ -474,6 +632,10 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.initUI()
 
+    def paintEvent(self, event):
+        startupTimer.mark("first paint")
+        super().paintEvent(event)
+
     def initUI(self):
         self.chatGPT = QChatGpt(self)
         self.setCentralWidget(self.chatGPT)
@@ -520,6 +682,11 @@ class MainWindow(QMainWindow):
         new_action.setShortcut("Ctrl+L")
         new_action.triggered.connect(self.chatGPT.multilineButtonClicked)
         file_menu.addAction(new_action)
+        if config.developer:
+            new_action = QAction(config.thisTranslation["requestLatency"], self)
+            new_action.setShortcut("Ctrl+Shift+L")
+            new_action.triggered.connect(self.toggleLatencyPanel)
+            file_menu.addAction(new_action)
         file_menu.addSeparator()
         exit_action = QAction(config.thisTranslation["exit"], self)
         exit_action.setShortcut("Ctrl+Q")
@@ -529,6 +696,16 @@ class MainWindow(QMainWindow):
         self.resize(QGuiApplication.primaryScreen().availableSize() * 3 / 4)
         self.show()
 
+    def toggleLatencyPanel(self):
+        if not hasattr(self, "latencyDock"):
+            from util.latencypanel import LatencyPanel
+
+            self.latencyDock = QDockWidget(config.thisTranslation["requestLatency"], self)
+            self.latencyDock.setWidget(LatencyPanel(self.latencyDock))
+            self.addDockWidget(Qt.RightDockWidgetArea, self.latencyDock)
+        else:
+            self.latencyDock.setVisible(not self.latencyDock.isVisible())
+
     def openDatabaseDirectory(self):
         databaseDirectory = os.path.dirname(
             os.path.abspath(config.chatGPTApiLastChatDatabase)
@@ -579,24 +756,10 @@ if __name__ == "__main__":
             config.mainWindow.bringToForeground(config.mainWindow)
 
     def aboutToQuit():
-        with open("config.py", "w", encoding="utf-8") as fileObj:
-            for name in dir(config):
-                if not name.startswith("__") and (
-                    not name
-                    in (
-                        "mainWindow",
-                        "chatGPTApi",
-                        "chatGPTTransformers",
-                        "predefinedContext",
-                        "predefinedContexts",
-                        "inputSuggestions",
-                    )
-                ):
-                    try:
-                        value = eval(f"config.{name}")
-                        fileObj.write("{0} = {1}\n".format(name, pprint.pformat(value)))
-                    except:
-                        pass
+        # let the database thread finish the writes it still has queued
+        config.chatGPTApi.database.close()
+        # most changes are written during the session; this catches the rest
+        settings.close()
 
     thisOS = platform.system()
     appName = "ChatGPT-GUI"
@@ -607,13 +770,36 @@ if __name__ == "__main__":
             os.path.join(sys.path[0], "icons", f"{appName}.ico")
         )
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(windowsIconPath)
+    # python QChatGpt.py --startup-report writes the time of each phase to startup.log
+    startupReport = "--startup-report" in sys.argv
+    if startupReport:
+        sys.argv.remove("--startup-report")
     app = QApplication(sys.argv)
+    # see util.qtrefs; a streaming answer spends a few hundred references a second
+    refsTimer = QTimer(app)
+    refsTimer.timeout.connect(topUp)
+    refsTimer.start(1000)
+    startupTimer.mark("QApplication")
     iconPath = os.path.abspath(os.path.join(sys.path[0], "icons", f"{appName}.png"))
-    app.setStyleSheet(qdarkstyle.load_stylesheet())
+    # needed before the first paint, or the window would flash unstyled;
+    # naming the binding spares qtpy from probing for PyQt5 first
+    import qdarkstyle
+
+    app.setStyleSheet(qdarkstyle.load_stylesheet(qt_api="pyside6"))
     appIcon = QIcon(iconPath)
     app.setWindowIcon(appIcon)
+    startupTimer.mark("stylesheet")
     showMainWindow()
+    startupTimer.mark("main window")
     app.aboutToQuit.connect(aboutToQuit)
+
+    def startupFinished():
+        preloadChatBackend()
+        if startupReport:
+            startupTimer.write(os.path.join(wd, "startup.log"))
+            print(startupTimer.report(), file=sys.stderr)
+
+    startupTimer.whenDone(("first paint", "history loaded"), startupFinished)
     if thisOS == "Windows":
         desktopPath = os.path.join(os.path.expanduser("~"), "Desktop")
         shortcutDir = desktopPath if os.path.isdir(desktopPath) else wd
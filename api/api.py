@@ -1,4 +1,13 @@
+import codecs
+import socket
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from api.resilience import RetryPolicy, Cancelled, RETRYABLE_STATUS, parseRetryAfter
+from api.latency import RequestTiming
 
 true = True
 false = False
@@ -18,21 +27,359 @@ Sec-Fetch-Site: cross-site
 User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36
 """
 headers = dict(x.split(": ", 1) for x in headers.splitlines() if x)
+url = 'https://api.binjie.fun/api/generateStream'
 
 
-def chat(prompt):
-    data = {
+def getData(prompt, stream=False):
+    return {
         "prompt"        : prompt,
         "userId"        : "#/chat/1686749073469",
         "network"       : true,
         "system"        : "",
         "withoutContext": false,
-        "stream"        : false
+        "stream"        : stream
     }
-    url = 'https://api.binjie.fun/api/generateStream'
-    rsp = requests.post(url, json=data, headers=headers)
-    answer = rsp.content.decode('utf-8')
-    return answer
+
+
+class CancelToken:
+    '''
+    Lets another thread abort a request in flight.
+
+    While the request is sent and its headers awaited, the client
+    attaches the socket it goes out on; after that, the response it is
+    reading from. cancel() shuts down the socket underneath either, which
+    wakes the blocked thread at once. Only the DNS lookup and TCP connect
+    cannot be cut short; they are bounded by the connect timeout.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.sock = None
+        self.response = None
+        self.children = set()
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            sock = self.sock
+            response = self.response
+            children = list(self.children)
+        if sock is not None:
+            shutdown(sock)
+        if response is not None:
+            abort(response)
+        for child in children:
+            child.cancel()
+
+    def child(self):
+        '''
+        A token of its own for one of several requests running in parallel.
+
+        Only one response can be attached to a token; cancelling this one
+        also cancels every child not yet released.
+        '''
+        token = CancelToken()
+        with self.lock:
+            cancelled = self.event.is_set()
+            if not cancelled:
+                self.children.add(token)
+        if cancelled:
+            token.cancel()
+        return token
+
+    def release(self, child):
+        # the request of child is over; nothing left to abort
+        with self.lock:
+            self.children.discard(child)
+
+    def isCancelled(self):
+        return self.event.is_set()
+
+    def wait(self, timeout):
+        # sleep that ends early on cancel; True when cancelled
+        return self.event.wait(timeout)
+
+    def attachSocket(self, sock):
+        # None once the request is sent; the socket may go back to the pool
+        with self.lock:
+            self.sock = sock
+            cancelled = self.event.is_set()
+        if cancelled and sock is not None:
+            shutdown(sock)
+
+    def attach(self, response):
+        with self.lock:
+            self.response = response
+            cancelled = self.event.is_set()
+        if cancelled:
+            abort(response)
+
+
+# the token of the request being sent on this thread, for TimedConnection
+sending = threading.local()
+
+
+def shutdown(sock):
+    # close() alone does not wake a thread blocked in recv(); shutdown() does
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def abort(response):
+    connection = getattr(response.raw, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        shutdown(sock)
+    response.close()
+
+
+def classifyError(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return (
+            error.response.status_code in RETRYABLE_STATUS,
+            parseRetryAfter(error.response.headers.get("Retry-After")),
+        )
+    return isinstance(error, (requests.ConnectionError, requests.Timeout)), None
+
+
+def getOutcome(error, cancelToken=None):
+    # outcome label of a failed request for api.latency
+    if cancelToken is not None and cancelToken.isCancelled():
+        return "cancelled"
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f"http_{error.response.status_code}"
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    if isinstance(error, requests.ConnectionError):
+        return "connection"
+    return "error"
+
+
+class TimedConnection:
+    '''
+    Mixin for urllib3 connections that times the handshakes.
+
+    _new_conn() makes the TCP connection, DNS lookup included; the rest
+    of connect() on an HTTPS connection is the TLS handshake. The values
+    are taken, and cleared, by RequestTiming.responded().
+
+    The socket is also handed to the cancel token of the request being
+    sent, as soon as it exists, so that a cancel interrupts the TLS
+    handshake, the upload and the wait for the headers too.
+    '''
+    secure = False
+    connectSeconds = None
+    tlsSeconds = None
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            sock = super()._new_conn()
+        finally:
+            self.connectSeconds = time.perf_counter() - start
+        self.watch(sock)
+        return sock
+
+    def request(self, *args, **kwargs):
+        # a pooled connection is not connected again
+        if self.sock is not None:
+            self.watch(self.sock)
+        return super().request(*args, **kwargs)
+
+    def watch(self, sock):
+        cancelToken = getattr(sending, "cancelToken", None)
+        if cancelToken is not None:
+            cancelToken.attachSocket(sock)
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        if self.secure and self.connectSeconds is not None:
+            self.tlsSeconds = max(0.0, time.perf_counter() - start - self.connectSeconds)
+
+
+class TimedHTTPConnection(TimedConnection, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+    secure = True
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    # pools are created on first use, so swapping the classes here covers them all
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class ChatClient:
+    '''
+    Chat backend client
+
+    Owns one requests.Session with a keep-alive connection pool, so that
+    consecutive prompts reuse the TCP/TLS connection instead of paying a
+    new DNS lookup and handshake each time. Every attempt is timed and
+    recorded in api.latency.latency.
+
+    :param url: endpoint of the chat backend
+    :param poolSize: maximum number of pooled connections per host
+    :param connectTimeout: seconds to wait for the connection to be made
+    :param readTimeout: seconds to wait between bytes of the response
+    :param retry: api.resilience.RetryPolicy wrapped around every request
+    :param limiter: optional api.ratelimit.RateLimiter every attempt waits on
+    :param estimatedTokens: tokens charged to the limiter per request
+    '''
+
+    def __init__(
+        self,
+        url=url,
+        poolSize=10,
+        connectTimeout=5.0,
+        readTimeout=120.0,
+        retry=None,
+        limiter=None,
+        estimatedTokens=512,
+    ):
+        self.url = url
+        self.timeout = (connectTimeout, readTimeout)
+        self.retry = retry if retry is not None else RetryPolicy("chat", classifyError)
+        self.limiter = limiter
+        self.estimatedTokens = estimatedTokens
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.headers["Connection"] = "keep-alive"
+        adapter = TimedAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def getData(self, prompt, stream=False):
+        return getData(prompt, stream)
+
+    def post(self, data, cancelToken=None):
+        if self.limiter is not None and not self.limiter.acquire(self.estimatedTokens, cancelToken):
+            raise Cancelled("Request cancelled while waiting for the rate limiter.")
+        timing = RequestTiming("chat")
+        sending.cancelToken = cancelToken
+        try:
+            try:
+                # the body is read lazily so that a cancel token can abort the download
+                rsp = self.session.post(self.url, json=data, timeout=self.timeout, stream=True)
+            finally:
+                sending.cancelToken = None
+                if cancelToken is not None:
+                    cancelToken.attachSocket(None)
+            timing.responded(getattr(rsp.raw, "_connection", None))
+            if not rsp.ok:
+                rsp.close()
+                rsp.raise_for_status()
+        except Exception as error:
+            timing.finish(getOutcome(error, cancelToken))
+            raise
+        # whoever reads the body finishes the timing
+        rsp.timing = timing
+        if cancelToken is not None:
+            cancelToken.attach(rsp)
+        return rsp
+
+    def fetch(self, prompt, cancelToken=None):
+        with self.post(self.getData(prompt), cancelToken) as rsp:
+            try:
+                content = rsp.content
+            except Exception as error:
+                rsp.timing.finish(getOutcome(error, cancelToken), rsp.raw.tell())
+                raise
+            rsp.timing.finish("ok", rsp.raw.tell())
+            return content.decode('utf-8')
+
+    def chat(self, prompt, cancelToken=None):
+        if cancelToken is not None and cancelToken.isCancelled():
+            return ""
+        try:
+            return self.retry.call(self.fetch, prompt, cancelToken, cancelToken=cancelToken)
+        except Exception:
+            if cancelToken is not None and cancelToken.isCancelled():
+                return ""
+            raise
+
+    def stream(self, prompt, cancelToken=None):
+        '''
+        Yield the answer as text chunks while it is being generated.
+
+        Bytes are decoded incrementally, so a multibyte character split
+        across two network chunks is emitted once it is complete. When
+        cancelToken is cancelled the generator stops early; text already
+        yielded is the partial answer. Only the request is retried, never
+        a stream that has started.
+        '''
+        if cancelToken is not None and cancelToken.isCancelled():
+            return
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        try:
+            rsp = self.retry.call(
+                self.post, self.getData(prompt, stream=true), cancelToken, cancelToken=cancelToken
+            )
+        except Exception:
+            if cancelToken is not None and cancelToken.isCancelled():
+                return
+            raise
+        with rsp:
+            # also when the caller stops iterating early
+            outcome = "cancelled"
+            try:
+                for chunk in rsp.iter_content(chunk_size=None):
+                    text = decoder.decode(chunk)
+                    if text:
+                        yield text
+                    if cancelToken is not None and cancelToken.isCancelled():
+                        return
+                outcome = "ok"
+            except Exception as error:
+                outcome = getOutcome(error, cancelToken)
+                if cancelToken is not None and cancelToken.isCancelled():
+                    return
+                raise
+            finally:
+                rsp.timing.finish(outcome, rsp.raw.tell())
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+    def close(self):
+        self.session.close()
+
+
+client = None
+clientLock = threading.Lock()
+
+
+def getClient(**kwargs):
+    # the first caller decides the pool settings; everyone shares the client
+    global client
+    if client is None:
+        with clientLock:
+            # two threads may both have seen None; only the first creates it
+            if client is None:
+                client = ChatClient(**kwargs)
+    return client
+
+
+def chat(prompt):
+    return getClient().chat(prompt)
 
 
 # while True:
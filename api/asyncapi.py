@@ -0,0 +1,167 @@
+import asyncio
+import codecs
+import time
+import aiohttp
+from api.api import url, headers, getData
+from api.resilience import RetryPolicy, RETRYABLE_STATUS, parseRetryAfter
+from api.latency import RequestTiming
+
+
+def classifyError(error):
+    if isinstance(error, aiohttp.ClientResponseError):
+        return (
+            error.status in RETRYABLE_STATUS,
+            parseRetryAfter(error.headers.get("Retry-After") if error.headers else None),
+        )
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)), None
+
+
+def getOutcome(error):
+    # outcome label of a failed request for api.latency
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"http_{error.status}"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return "connection"
+    return "error"
+
+
+def getTraceConfig():
+    '''
+    Hooks that fill in the RequestTiming passed as trace_request_ctx.
+
+    The wait for a free connection of the pool counts as queue wait.
+    aiohttp makes the TCP and TLS handshakes in one step, so connect
+    covers both and tls stays unknown.
+    '''
+    async def started(session, context, params):
+        context.start = time.perf_counter()
+
+    async def queued(session, context, params):
+        waited = time.perf_counter() - context.start
+        context.trace_request_ctx.queueWait += waited
+        # as with the thread pool, ttfb and total start once the wait is over
+        context.trace_request_ctx.start += waited
+
+    async def connected(session, context, params):
+        context.trace_request_ctx.connect = time.perf_counter() - context.start
+
+    traceConfig = aiohttp.TraceConfig()
+    traceConfig.on_connection_queued_start.append(started)
+    traceConfig.on_connection_queued_end.append(queued)
+    traceConfig.on_connection_create_start.append(started)
+    traceConfig.on_connection_create_end.append(connected)
+    return traceConfig
+
+
+class AsyncChatClient:
+    '''
+    Asyncio counterpart of api.api.ChatClient
+
+    Many conversations share one aiohttp session on a single event loop,
+    so parallel chats cost sockets rather than threads. The session is
+    created lazily because it has to belong to the running loop. Every
+    attempt is timed and recorded in api.latency.latency.
+
+    :param url: endpoint of the chat backend
+    :param poolSize: maximum number of simultaneous connections
+    :param connectTimeout: seconds to wait for the connection to be made
+    :param readTimeout: seconds to wait between bytes of the response
+    :param retry: api.resilience.RetryPolicy wrapped around every request
+    :param limiter: optional api.ratelimit.RateLimiter every attempt waits on
+    :param estimatedTokens: tokens charged to the limiter per request
+    '''
+
+    def __init__(
+        self,
+        url=url,
+        poolSize=100,
+        connectTimeout=5.0,
+        readTimeout=120.0,
+        retry=None,
+        limiter=None,
+        estimatedTokens=512,
+    ):
+        self.url = url
+        self.poolSize = poolSize
+        self.retry = retry if retry is not None else RetryPolicy("chat", classifyError)
+        self.limiter = limiter
+        self.estimatedTokens = estimatedTokens
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connectTimeout, sock_read=readTimeout
+        )
+        self.session = None
+
+    def getSession(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers=headers,
+                connector=aiohttp.TCPConnector(limit=self.poolSize),
+                timeout=self.timeout,
+                trace_configs=[getTraceConfig()],
+            )
+        return self.session
+
+    async def post(self, data):
+        if self.limiter is not None:
+            await self.limiter.acquireAsync(self.estimatedTokens)
+        timing = RequestTiming("chat", queueWait=0.0)
+        try:
+            rsp = await self.getSession().post(self.url, json=data, trace_request_ctx=timing)
+            timing.responded()
+            if not rsp.ok:
+                rsp.release()
+                rsp.raise_for_status()
+        except BaseException as error:
+            timing.finish(getOutcome(error))
+            raise
+        # whoever reads the body finishes the timing
+        rsp.timing = timing
+        return rsp
+
+    async def fetch(self, prompt):
+        async with await self.post(getData(prompt)) as rsp:
+            try:
+                content = await rsp.read()
+            except BaseException as error:
+                rsp.timing.finish(getOutcome(error), rsp.content.total_bytes)
+                raise
+            rsp.timing.finish("ok", rsp.content.total_bytes)
+            return content.decode('utf-8')
+
+    async def chat(self, prompt):
+        return await self.retry.callAsync(self.fetch, prompt)
+
+    async def stream(self, prompt):
+        '''
+        Yield the answer as text chunks while it is being generated.
+
+        Cancelling the task that iterates this generator closes the response.
+        Only the request is retried, never a stream that has started.
+        '''
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        rsp = await self.retry.callAsync(self.post, getData(prompt, stream=True))
+        async with rsp:
+            # also when the caller stops iterating early
+            outcome = "cancelled"
+            try:
+                async for chunk in rsp.content.iter_any():
+                    text = decoder.decode(chunk)
+                    if text:
+                        yield text
+                outcome = "ok"
+            except Exception as error:
+                outcome = getOutcome(error)
+                raise
+            finally:
+                rsp.timing.finish(outcome, rsp.content.total_bytes)
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
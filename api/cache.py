@@ -0,0 +1,83 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    '''
+    On-disk cache of answers to identical prompts
+
+    Entries are keyed on a hash of everything that shapes the answer, expire
+    after ttl seconds and are evicted least recently used first once there
+    are more than maxEntries. The connection is shared between threads.
+
+    :param filePath: SQLite file to keep the cache in
+    :param ttl: seconds an answer stays valid
+    :param maxEntries: number of answers kept
+    '''
+
+    def __init__(self, filePath, ttl=7 * 24 * 3600, maxEntries=1000):
+        self.filePath = filePath
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filePath, check_same_thread=False)
+        # losing the last few entries on a crash is harmless, an fsync per hit is not
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, answer TEXT, created REAL, used REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(prompt, model, temperature, context):
+        text = json.dumps([prompt, model, temperature, context], ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT answer, created FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, answer):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, answer, created, used) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now),
+            )
+            self.connection.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+            self.connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.maxEntries,),
+            )
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM cache")
+            self.connection.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            (entries,) = self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+import time
+
+
+class Histogram:
+    '''
+    Cumulative bucket counts of observed durations, like a Prometheus histogram.
+
+    Quantiles are interpolated within the bucket they fall into, the way
+    Prometheus' histogram_quantile() does, so memory stays the same however
+    many requests are observed. Buckets grow by half each step, which keeps
+    a quantile within about a quarter of the true value.
+    '''
+    # seconds, 1ms to about 5 minutes
+    buckets = tuple(float(f"{0.001 * 1.5 ** i:.3g}") for i in range(32))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    # beyond the last bucket nothing is known but its bound
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+# thread pool wait of the job running on the current thread, for its first request
+queueWaits = threading.local()
+
+
+def setQueueWait(seconds):
+    queueWaits.seconds = seconds
+
+
+def takeQueueWait():
+    seconds = getattr(queueWaits, "seconds", None)
+    queueWaits.seconds = None
+    return seconds
+
+
+class RequestTiming:
+    '''
+    Where the time of one HTTP request went.
+
+    All values are seconds. queueWait is how long the job waited for a
+    worker thread, connect and tls are the handshakes of a new connection
+    (None when a pooled one was reused), ttfb runs from sending the request
+    to the first byte of the response and total until the body is read.
+
+    :param backend: name the request is counted under
+    :param queueWait: None to take it from the job running on this thread
+    '''
+    phases = ("queueWait", "connect", "tls", "ttfb", "total")
+
+    def __init__(self, backend, queueWait=None):
+        self.backend = backend
+        self.start = time.perf_counter()
+        self.time = time.time()
+        self.queueWait = takeQueueWait() if queueWait is None else queueWait
+        self.connect = None
+        self.tls = None
+        self.ttfb = None
+        self.total = None
+        self.bytes = 0
+        self.outcome = None
+
+    def responded(self, connection=None):
+        '''Call when the response headers arrive; connection is the one it came on.'''
+        self.ttfb = time.perf_counter() - self.start
+        if connection is not None:
+            # set by api.api.TimedConnection when it was opened for this request
+            self.connect = getattr(connection, "connectSeconds", None)
+            self.tls = getattr(connection, "tlsSeconds", None)
+            connection.connectSeconds = connection.tlsSeconds = None
+
+    def finish(self, outcome, bytes=0):
+        '''Record the request once; later calls are ignored.'''
+        if self.outcome is not None:
+            return
+        self.total = time.perf_counter() - self.start
+        self.outcome = outcome
+        self.bytes = bytes
+        latency.record(self)
+
+    def asDict(self):
+        record = {"time": round(self.time, 3), "backend": self.backend}
+        for phase in self.phases:
+            value = getattr(self, phase)
+            record[phase] = None if value is None else round(value, 6)
+        record["bytes"] = self.bytes
+        record["outcome"] = self.outcome
+        return record
+
+
+class Latency:
+    '''
+    Thread safe latency histograms per backend and phase.
+
+    Besides the histograms it counts outcomes ("ok", "cancelled",
+    "timeout", "connection", "http_<status>" or "error") and bytes
+    received. openLog() additionally appends every request as one JSON
+    line. Listeners are called with each RequestTiming.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.outcomes = {}
+        self.bytes = {}
+        self.listeners = []
+        self.log = None
+
+    def record(self, timing):
+        with self.lock:
+            for phase in timing.phases:
+                value = getattr(timing, phase)
+                if value is not None:
+                    key = (timing.backend, phase)
+                    if key not in self.histograms:
+                        self.histograms[key] = Histogram()
+                    self.histograms[key].observe(value)
+            key = (timing.backend, timing.outcome)
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+            self.bytes[timing.backend] = self.bytes.get(timing.backend, 0) + timing.bytes
+            if self.log is not None:
+                self.log.write(json.dumps(timing.asDict()) + "\n")
+                self.log.flush()
+        for listener in self.listeners:
+            listener(timing)
+
+    def openLog(self, filePath):
+        '''Append every request from now on to filePath as JSON lines.'''
+        log = open(filePath, "a", encoding="utf-8")
+        with self.lock:
+            previous, self.log = self.log, log
+        if previous is not None:
+            previous.close()
+
+    def closeLog(self):
+        with self.lock:
+            log, self.log = self.log, None
+        if log is not None:
+            log.close()
+
+    def snapshot(self):
+        '''{backend: {"requests", "bytes", "outcomes", phase: {"count", "p50", "p95", "p99"}}}'''
+        result = {}
+        with self.lock:
+            for (backend, outcome), count in self.outcomes.items():
+                entry = result.setdefault(backend, {"requests": 0, "bytes": 0, "outcomes": {}})
+                entry["requests"] += count
+                entry["outcomes"][outcome] = count
+            for backend, count in self.bytes.items():
+                result[backend]["bytes"] = count
+            for (backend, phase), histogram in self.histograms.items():
+                result[backend][phase] = {
+                    "count": histogram.count,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+        return result
+
+    def prometheus(self):
+        '''Everything recorded, in the Prometheus text exposition format.'''
+        lines = [
+            "# HELP chatgpt_gui_request_seconds Time spent in each phase of a backend request.",
+            "# TYPE chatgpt_gui_request_seconds histogram",
+        ]
+        with self.lock:
+            for (backend, phase), histogram in sorted(self.histograms.items()):
+                labels = f'backend="{backend}",phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets(), histogram.counts):
+                    cumulative += count
+                    lines.append(f'chatgpt_gui_request_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"chatgpt_gui_request_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"chatgpt_gui_request_seconds_count{{{labels}}} {histogram.count}")
+            lines.append("# HELP chatgpt_gui_requests_total Backend requests by outcome.")
+            lines.append("# TYPE chatgpt_gui_requests_total counter")
+            for (backend, outcome), count in sorted(self.outcomes.items()):
+                lines.append(f'chatgpt_gui_requests_total{{backend="{backend}",outcome="{outcome}"}} {count}')
+            lines.append("# HELP chatgpt_gui_received_bytes_total Response body bytes received.")
+            lines.append("# TYPE chatgpt_gui_received_bytes_total counter")
+            for backend, count in sorted(self.bytes.items()):
+                lines.append(f'chatgpt_gui_received_bytes_total{{backend="{backend}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def buckets(self):
+        return [str(bound) for bound in Histogram.buckets] + ["+Inf"]
+
+    def writePrometheus(self, filePath):
+        # written beside and renamed, so a textfile collector never reads half a file
+        temporary = filePath + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as fileObj:
+            fileObj.write(self.prometheus())
+        os.replace(temporary, filePath)
+
+
+latency = Latency()
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+from api.resilience import metrics
+
+
+class TokenBucket:
+    '''
+    Classic token bucket that hands out reservations.
+
+    reserve() always succeeds but may leave the bucket in debt; the caller
+    waits the returned number of seconds, so callers are served in the
+    order they arrived instead of racing for refills.
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # a request larger than the bucket would otherwise wait forever
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class RateLimiter:
+    '''
+    Client side limits for one backend.
+
+    :param name: backend name used for metrics
+    :param requestsPerSecond: request rate; one second worth may burst, 0 for no limit
+    :param tokensPerMinute: estimated token budget per minute, 0 for no limit
+
+    When the budget is used up, acquire() queues the caller rather than
+    letting the request fail upstream with 429.
+    '''
+
+    def __init__(self, name, requestsPerSecond=0, tokensPerMinute=0):
+        self.name = name
+        self.requests = (
+            TokenBucket(requestsPerSecond, max(1.0, requestsPerSecond))
+            if requestsPerSecond
+            else None
+        )
+        self.tokens = (
+            TokenBucket(tokensPerMinute / 60.0, tokensPerMinute) if tokensPerMinute else None
+        )
+
+    def reserve(self, tokens):
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            metrics.record(self.name, "throttled")
+            metrics.record(self.name, "throttledSeconds", wait)
+        return wait
+
+    def release(self, tokens):
+        if self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None:
+            self.tokens.refund(tokens)
+
+    def acquire(self, tokens=1, cancelToken=None):
+        '''Block until the request may go out; False if cancelled while queued.'''
+        wait = self.reserve(tokens)
+        if wait <= 0:
+            return True
+        if cancelToken is not None:
+            if cancelToken.wait(wait):
+                self.release(tokens)
+                return False
+        else:
+            time.sleep(wait)
+        return True
+
+    async def acquireAsync(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.release(tokens)
+                raise
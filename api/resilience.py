@@ -0,0 +1,246 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+# statuses worth another attempt; anything else in 4xx is the caller's fault
+RETRYABLE_STATUS = (408, 425, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def parseRetryAfter(value):
+    '''Seconds to wait from a Retry-After header, either delta-seconds or an HTTP date.'''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Metrics:
+    '''
+    Thread safe counters per backend.
+
+    Events are attempt, success, failure, retry, backoff (seconds slept),
+    cancelled, rejected (failed fast by the circuit breaker) and
+    circuitOpened.
+    Listeners are called with (backend, event, value) on every record.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.listeners = []
+
+    def record(self, backend, event, value=1):
+        with self.lock:
+            key = (backend, event)
+            self.counters[key] = self.counters.get(key, 0) + value
+        for listener in self.listeners:
+            listener(backend, event, value)
+
+    def snapshot(self):
+        with self.lock:
+            return {f"{backend}.{event}": value for (backend, event), value in self.counters.items()}
+
+
+metrics = Metrics()
+
+
+class CircuitBreaker:
+    '''
+    Fails fast while an upstream is down.
+
+    After failureThreshold consecutive failures the circuit opens and
+    calls are rejected for resetTimeout seconds. Then a single trial call
+    is let through: success closes the circuit, failure opens it again.
+    '''
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, name, failureThreshold=5, resetTimeout=30.0):
+        self.name = name
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = 0.0
+        self.trialRunning = False
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.openedAt < self.resetTimeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.trialRunning = False
+            if self.state == self.HALF_OPEN:
+                if self.trialRunning:
+                    return False
+                self.trialRunning = True
+            return True
+
+    def recordSuccess(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trialRunning = False
+
+    def release(self):
+        # the call was cancelled and says nothing about the upstream; a
+        # half-open circuit lets the next call be its trial instead
+        with self.lock:
+            self.trialRunning = False
+
+    def recordFailure(self):
+        with self.lock:
+            self.failures += 1
+            self.trialRunning = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failureThreshold
+            ):
+                self.state = self.OPEN
+                self.openedAt = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            metrics.record(self.name, "circuitOpened")
+
+
+class RetryPolicy:
+    '''
+    Retries a call with capped exponential backoff and full jitter.
+
+    :param name: backend name used for metrics and the circuit breaker
+    :param classify: function(error) -> (retryable, retryAfter seconds or None)
+    :param maxAttempts: attempts in total, including the first one
+    :param baseDelay: backoff before the first retry is drawn from [0, baseDelay]
+    :param maxDelay: cap on any single wait, Retry-After included
+    '''
+
+    def __init__(
+        self,
+        name,
+        classify,
+        maxAttempts=4,
+        baseDelay=0.5,
+        maxDelay=30.0,
+        failureThreshold=5,
+        resetTimeout=30.0,
+    ):
+        self.name = name
+        self.classify = classify
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.breaker = CircuitBreaker(name, failureThreshold, resetTimeout)
+
+    def backoff(self, attempt, retryAfter=None):
+        if retryAfter is not None:
+            return min(retryAfter, self.maxDelay)
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1)))
+
+    def before(self):
+        if not self.breaker.allow():
+            metrics.record(self.name, "rejected")
+            raise CircuitOpenError(f"The {self.name} service is unavailable; please try again later.")
+        metrics.record(self.name, "attempt")
+
+    def succeeded(self):
+        self.breaker.recordSuccess()
+        metrics.record(self.name, "success")
+
+    def cancelled(self):
+        self.breaker.release()
+        metrics.record(self.name, "cancelled")
+
+    def failed(self, error, attempt):
+        # returns the delay before the next attempt, or None to give up
+        retryable, retryAfter = self.classify(error)
+        if not retryable:
+            # the upstream answered, so it is up; the request itself was bad
+            self.breaker.recordSuccess()
+            metrics.record(self.name, "failure")
+            return None
+        self.breaker.recordFailure()
+        if attempt >= self.maxAttempts or self.breaker.state == CircuitBreaker.OPEN:
+            metrics.record(self.name, "failure")
+            return None
+        delay = self.backoff(attempt, retryAfter)
+        metrics.record(self.name, "retry")
+        metrics.record(self.name, "backoff", delay)
+        return delay
+
+    def call(self, fn, *args, cancelToken=None, **kwargs):
+        '''
+        Run fn until it succeeds or gives up, re-raising its last error.
+
+        A cancelToken interrupts the wait between attempts. A cancelled
+        call is neither retried nor counted by the circuit breaker: the
+        error it ends with comes from the abort, not from the upstream.
+        '''
+        attempt = 0
+        while True:
+            self.before()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as error:
+                if isinstance(error, Cancelled) or (
+                    cancelToken is not None and cancelToken.isCancelled()
+                ):
+                    self.cancelled()
+                    raise
+                attempt += 1
+                delay = self.failed(error, attempt)
+                if delay is None:
+                    raise
+                if cancelToken is not None:
+                    if cancelToken.wait(delay):
+                        raise
+                else:
+                    time.sleep(delay)
+            except BaseException:
+                # interrupted, e.g. by KeyboardInterrupt or GeneratorExit
+                self.cancelled()
+                raise
+            else:
+                self.succeeded()
+                return result
+
+    async def callAsync(self, fn, *args, **kwargs):
+        '''Coroutine version of call; cancelling the task interrupts the wait.'''
+        attempt = 0
+        while True:
+            self.before()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as error:
+                if isinstance(error, Cancelled):
+                    self.cancelled()
+                    raise
+                attempt += 1
+                delay = self.failed(error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            except BaseException:
+                # the task was cancelled, e.g. by AsyncWorker.cancel
+                self.cancelled()
+                raise
+            else:
+                self.succeeded()
+                return result
@@ -0,0 +1,47 @@
+import os, sys, time, statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import requests
+from api.api import ChatClient, headers
+from benchmarks.stubserver import StubServer
+
+
+def timeit(fn, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        "{0:<12} mean {1:8.3f} ms   median {2:8.3f} ms".format(
+            name,
+            statistics.mean(timings) * 1000,
+            statistics.median(timings) * 1000,
+        )
+    )
+
+
+def main(rounds=500):
+    with StubServer() as server:
+        data = ChatClient(server.url).getData("benchmark")
+
+        def bare():
+            requests.post(server.url, json=data, headers=headers).content
+
+        client = ChatClient(server.url)
+        client.chat("warm up")
+        pooled = timeit(lambda: client.chat("benchmark"), rounds)
+        client.close()
+        unpooled = timeit(bare, rounds)
+    report("bare post", unpooled)
+    report("ChatClient", pooled)
+    saved = statistics.mean(unpooled) - statistics.mean(pooled)
+    print("saved per request: {0:.3f} ms".format(saved * 1000))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
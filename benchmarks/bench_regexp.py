@@ -0,0 +1,61 @@
+import os, re, sys, tempfile, time
+
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root)
+from configDefault import config, settings
+from util.database import Database
+
+# the search settings changed below are for this run only
+settings.untrack()
+
+
+def legacyRegexp(expr, item):
+    # the REGEXP callback before compiled patterns were cached
+    reg = re.compile(expr, flags=re.IGNORECASE)
+    return reg.search(item) is not None
+
+
+def populate(database, rows):
+    database.cursor.executemany(
+        "INSERT INTO data (id, title) VALUES (?, ?)",
+        ((f"2023-01-01-{i:06d}", f"Conversation {i} about topic {i % 97}") for i in range(rows)),
+    )
+    database.cursor.executemany(
+        "INSERT INTO messages (conversation_id, seq, role, text) VALUES (?, ?, ?, ?)",
+        (
+            message
+            for i in range(rows)
+            for message in (
+                (f"2023-01-01-{i:06d}", 0, "user", f"question {i}"),
+                (f"2023-01-01-{i:06d}", 1, "assistant", f"Answer number {i} mentions streaming and sqlite."),
+            )
+        ),
+    )
+    database.connection.commit()
+
+
+def timeSearch(database, title, content, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = database.search(title, content)
+    return (time.perf_counter() - start) / rounds, len(result)
+
+
+def main(rows=100000, rounds=3):
+    config.regexpSearchEnabled = True
+    config.fullTextSearchEnabled = False
+    with tempfile.TemporaryDirectory() as directory:
+        database = Database(os.path.join(directory, "bench.chat"))
+        populate(database, rows)
+        title, content = "topic (1|2)3$", "stream.*sqlite"
+        cached, matches = timeSearch(database, title, content, rounds)
+        database.connection.create_function("REGEXP", 2, legacyRegexp)
+        legacy, _ = timeSearch(database, title, content, rounds)
+        database.connection.close()
+    print(f"{rows} rows, {matches} matches")
+    print(f"legacy REGEXP  {legacy * 1000:9.1f} ms")
+    print(f"cached REGEXP  {cached * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
@@ -0,0 +1,76 @@
+import os, sys, time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from PySide6.QtCore import QTimer
+from PySide6.QtWidgets import QApplication, QPlainTextEdit
+from QChatGpt import QChatGpt, config
+
+
+class Transcript:
+    # just enough of QChatGpt to run its rendering methods without a database
+    print = QChatGpt.print
+    printStream = QChatGpt.printStream
+    trailingNewlines = QChatGpt.trailingNewlines
+    appendText = QChatGpt.appendText
+    scrollToEnd = QChatGpt.scrollToEnd
+    doScrollToEnd = QChatGpt.doScrollToEnd
+
+    def __init__(self, text):
+        self.contentView = QPlainTextEdit()
+        self.scrollTimer = QTimer(self.contentView)
+        self.scrollTimer.setSingleShot(True)
+        self.scrollTimer.setInterval(0)
+        self.scrollTimer.timeout.connect(self.doScrollToEnd)
+        self.contentView.setReadOnly(True)
+        self.contentView.setUndoRedoEnabled(False)
+        self.contentView.setPlainText(text)
+
+
+def legacyPrintStream(contentView, text):
+    # what printStream did before appending through a QTextCursor
+    contentView.setPlainText(contentView.toPlainText() + text)
+    contentScrollBar = contentView.verticalScrollBar()
+    contentScrollBar.setValue(contentScrollBar.maximum())
+
+
+def makeTranscript(size):
+    turn = ">>> How do I stream text?\n\n" + "Stream it chunk by chunk. " * 20 + "\n\n"
+    return (turn * (size // len(turn) + 1))[:size]
+
+
+def main(chunks=10000, legacyChunks=200, size=1024 * 1024):
+    app = QApplication.instance() or QApplication(sys.argv)
+    transcript = makeTranscript(size)
+    chunk = "token "
+
+    view = Transcript(transcript)
+    start = time.perf_counter()
+    for _ in range(chunks):
+        view.printStream(chunk)
+        app.processEvents()
+    view.print("final answer")
+    elapsed = time.perf_counter() - start
+    print(
+        "printStream  {0} chunks into {1} bytes: {2:.3f} s ({3:.4f} ms/chunk)".format(
+            chunks, size, elapsed, elapsed * 1000 / chunks
+        )
+    )
+
+    # the old path is quadratic; time fewer chunks and report per-chunk cost
+    legacy = QPlainTextEdit()
+    legacy.setPlainText(transcript)
+    start = time.perf_counter()
+    for _ in range(legacyChunks):
+        legacyPrintStream(legacy, chunk)
+        app.processEvents()
+    elapsed = time.perf_counter() - start
+    print(
+        "setPlainText {0} chunks into {1} bytes: {2:.3f} s ({3:.4f} ms/chunk)".format(
+            legacyChunks, size, elapsed, elapsed * 1000 / legacyChunks
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:]))
@@ -0,0 +1,46 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients are allowed to keep the connection alive
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in two writes; with Nagle the body waits for
+    # the client's delayed ACK, adding ~40 ms that no real server has
+    disable_nagle_algorithm = True
+    answer = "Hello from the stub server.".encode("utf-8")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(self.answer)))
+        self.end_headers()
+        self.wfile.write(self.answer)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    '''
+    Local stand-in for the chat backend, served from a daemon thread.
+
+    Use as a context manager; ``url`` points at the running server.
+    '''
+
+    def __init__(self, handler=StubHandler):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{0}/api/generateStream".format(
+            self.server.server_address[1]
+        )
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,354 @@
+import argparse, fnmatch, gc, json, os, platform, sqlite3, statistics, subprocess, sys, tempfile, time
+
+# before anything imports Qt: no display needed, and the same platform everywhere
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root)
+from configDefault import config, settings
+from util.database import Database
+from api.api import ChatClient
+from benchmarks.stubserver import StubServer
+from util.qtrefs import topUp
+
+# the settings changed below are for this run only
+settings.untrack()
+baselinePath = os.path.join(root, "benchmarks", "baseline.json")
+
+
+def measure(fn, rounds, setup=None):
+    '''
+    Seconds per call of fn, once per round; setup runs untimed before each.
+
+    The garbage collector is paused while fn runs, as timeit does, so a
+    collection triggered by earlier rounds does not land in a later one.
+    '''
+    timings = []
+    for _ in range(rounds):
+        # untimed; a round of Qt calls must not exhaust None, see util.qtrefs
+        topUp()
+        argument = setup() if setup is not None else None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            fn() if setup is None else fn(argument)
+            timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return timings
+
+
+def transcript(i):
+    # the same text on every run, so every run searches the same rows
+    return (
+        f">>> question {i} about topic {i % 97}\n\n"
+        f"Answer number {i} mentions streaming and sqlite."
+    )
+
+
+def sizeName(rows):
+    return f"{rows // 1000}k" if rows % 1000 == 0 else str(rows)
+
+
+class Suite:
+    '''
+    Runs the benchmarks whose names match the patterns and collects results.
+
+    Each result is the time of one operation: the median and the fastest
+    of the rounds, the round count and which of the two compare() uses.
+    '''
+
+    # benchmarks that need a database of each size
+    databaseGroups = (
+        "database.insert",
+        "database.search.like",
+        "database.search.regexp",
+        "database.search.fts",
+        "gui.loadData",
+    )
+
+    def __init__(self, sizes, rounds, patterns=("*",)):
+        self.sizes = sizes
+        self.rounds = rounds
+        self.patterns = patterns
+        self.results = {}
+
+    def wanted(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+    def add(self, name, timings, operations=1, note="", statistic="min"):
+        timings = [timing / operations for timing in timings]
+        self.results[name] = {
+            "median": statistics.median(timings),
+            "min": min(timings),
+            "rounds": len(timings),
+            "statistic": statistic,
+            "note": note,
+        }
+        print(
+            f"{name:<34} median {self.results[name]['median'] * 1000:10.4f} ms  "
+            f"min {self.results[name]['min'] * 1000:10.4f} ms  {note}",
+            file=sys.stderr,
+        )
+
+    def run(self, directory):
+        config.databaseSynchronous = "NORMAL"
+        config.chatGPTTransformers = []
+        for rows in self.sizes:
+            size = sizeName(rows)
+            if not any(self.wanted(f"{group}.{size}") for group in self.databaseGroups):
+                continue
+            filePath = self.database(directory, rows)
+            self.search(filePath, rows)
+            self.loadData(filePath, rows)
+        self.render()
+        self.client()
+        return self.results
+
+    def database(self, directory, rows):
+        # the last database written is kept for the search and loadData runs
+        filePath = os.path.join(directory, f"{rows}.chat")
+
+        def fresh():
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(filePath + suffix):
+                    os.remove(filePath + suffix)
+            return Database(filePath)
+
+        def insert(database):
+            # one commit per conversation, as the GUI saves them
+            for i in range(rows):
+                database.insert(f"2023-01-01-{i:06d}", f"question {i} about topic {i % 97}", transcript(i))
+            database.close()
+
+        name = f"database.insert.{sizeName(rows)}"
+        if self.wanted(name):
+            self.add(name, measure(insert, self.rounds, fresh), rows, "per conversation")
+        else:
+            insert(fresh())
+        return filePath
+
+    def search(self, filePath, rows):
+        database = Database(filePath)
+        queries = (
+            ("like", False, False, ("topic 13", "streaming")),
+            ("regexp", True, False, ("topic (1|2)3$", "stream.*sqlite")),
+            ("fts", False, True, ("topic 13", "streaming")),
+        )
+        for kind, regexpSearch, fullTextSearch, (title, content) in queries:
+            name = f"database.search.{kind}.{sizeName(rows)}"
+            if not self.wanted(name):
+                continue
+            config.regexpSearchEnabled = regexpSearch
+            config.fullTextSearchEnabled = fullTextSearch
+            matches = len(database.search(title, content))
+            self.add(name, measure(lambda: database.search(title, content), self.rounds), note=f"{matches} matches")
+        database.close()
+
+    def loadData(self, filePath, rows):
+        name = f"gui.loadData.{sizeName(rows)}"
+        if not self.wanted(name):
+            return
+        try:
+            from PySide6.QtCore import QEventLoop, QTimer
+            from PySide6.QtWidgets import QApplication, QMainWindow
+        except ImportError:
+            print(f"{name}: PySide6 is not installed, skipped", file=sys.stderr)
+            return
+        app = QApplication.instance() or QApplication(sys.argv)
+        from QChatGpt import QChatGpt
+
+        config.chatGPTApiLastChatDatabase = filePath
+        window = QMainWindow()
+        chatGPT = QChatGpt(window)
+        model = chatGPT.listModel
+
+        def load():
+            # until the first page is in the list, like opening the database
+            loop = QEventLoop()
+            model.rowsInserted.connect(loop.quit)
+            QTimer.singleShot(30000, loop.quit)
+            chatGPT.loadData()
+            loop.exec()
+            model.rowsInserted.disconnect(loop.quit)
+            if not model.rowCount():
+                raise RuntimeError(f"{name}: no conversations were loaded")
+
+        load()
+        # bimodal: a round is quick when the page lands before the loop
+        # sleeps and some 45 ms slower when it does not, so the fastest
+        # round would hide a regression in the slow mode
+        self.add(name, measure(load, self.rounds), note=f"first {model.rowCount()} of {rows} rows", statistic="median")
+        chatGPT.database.close()
+        window.deleteLater()
+        app.processEvents()
+
+    def render(self, chunks=2000, prints=200):
+        names = [
+            f"render.{method}.{size // 1024}k"
+            for method in ("printStream", "print")
+            for size in (64 * 1024, 1024 * 1024)
+        ]
+        if not any(self.wanted(name) for name in names):
+            return
+        try:
+            from PySide6.QtWidgets import QApplication
+        except ImportError:
+            print("render: PySide6 is not installed, skipped", file=sys.stderr)
+            return
+        app = QApplication.instance() or QApplication(sys.argv)
+        from benchmarks.bench_render import Transcript, makeTranscript
+
+        for size in (64 * 1024, 1024 * 1024):
+            text = makeTranscript(size)
+
+            def stream(view):
+                # the transcript grows by every chunk, as while an answer streams in
+                for _ in range(chunks):
+                    view.printStream("token ")
+                    app.processEvents()
+
+            def answers(view):
+                for i in range(prints):
+                    view.print(f">>> question {i}\n\nA short answer to question {i}.")
+                    app.processEvents()
+
+            for method, fn, count in (("printStream", stream, chunks), ("print", answers, prints)):
+                name = f"render.{method}.{size // 1024}k"
+                if self.wanted(name):
+                    self.add(name, measure(fn, self.rounds, lambda: Transcript(text)), count, f"per call on a {size // 1024} KiB transcript")
+
+    def client(self, requests=200):
+        names = ("client.chat", "client.stream")
+        if not any(self.wanted(name) for name in names):
+            return
+        with StubServer() as server:
+            client = ChatClient(server.url)
+            client.chat("warm up")
+            if self.wanted("client.chat"):
+                self.add(
+                    "client.chat",
+                    measure(lambda: [client.chat("benchmark") for _ in range(requests)], self.rounds),
+                    requests,
+                    "per request on a pooled connection",
+                )
+            if self.wanted("client.stream"):
+                self.add(
+                    "client.stream",
+                    measure(lambda: [list(client.stream("benchmark")) for _ in range(requests)], self.rounds),
+                    requests,
+                    "per request on a pooled connection",
+                )
+            client.close()
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    try:
+        import PySide6
+
+        qt = PySide6.__version__
+    except ImportError:
+        qt = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "sqlite": sqlite3.sqlite_version,
+        "pyside6": qt,
+    }
+
+
+def compare(results, baseline, threshold, floor, stream=sys.stdout):
+    '''
+    Print each result beside the baseline; returns the names that regressed.
+
+    The fastest rounds are compared: other load on the machine only ever
+    makes a round slower, so the minimum varies far less than the median.
+    Benchmarks whose rounds fall into distinct modes compare the median
+    instead, as their result says. A benchmark regressed when it is more than threshold slower than the
+    baseline and by more than floor seconds, so that timer noise on very
+    short operations is not reported.
+    '''
+    regressed = []
+    print(f"{'benchmark':<34} {'baseline ms':>12} {'current ms':>12} {'change':>8}", file=stream)
+    for name, result in results.items():
+        statistic = result.get("statistic", "min")
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<34} {'-':>12} {result[statistic] * 1000:12.4f} {'new':>8}", file=stream)
+            continue
+        change = result[statistic] / before[statistic] - 1 if before[statistic] else 0.0
+        slower = change > threshold and result[statistic] - before[statistic] > floor
+        if slower:
+            regressed.append(name)
+        print(
+            f"{name:<34} {before[statistic] * 1000:12.4f} {result[statistic] * 1000:12.4f} "
+            f"{change:+8.1%}{'  REGRESSION' if slower else ''}",
+            file=stream,
+        )
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="benchmarks/suite.py",
+        description="Offline benchmarks of the storage, rendering and client hot paths",
+    )
+    parser.add_argument("--only", nargs="+", default=["*"], help="glob patterns of the benchmarks to run, e.g. 'database.search.*'")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000], help="conversations in the benchmark databases")
+    parser.add_argument("--quick", action="store_true", help="leave out the 100k database")
+    parser.add_argument("--rounds", type=int, default=3, help="timed rounds of every benchmark")
+    parser.add_argument("--output", default="", help="write the results as JSON to this file, or - for stdout")
+    parser.add_argument("--baseline", default=baselinePath, help="results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown against the baseline that counts as a regression")
+    parser.add_argument("--floor", type=float, default=0.00005, help="seconds a slowdown must also exceed")
+    args = parser.parse_args(argv)
+    sizes = [size for size in args.sizes if not (args.quick and size > 10000)]
+
+    suite = Suite(sizes, args.rounds, args.only)
+    with tempfile.TemporaryDirectory() as directory:
+        results = suite.run(directory)
+    report = {"environment": environment(), "results": results}
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as fileObj:
+            json.dump(report, fileObj, indent=2)
+    if args.save_baseline:
+        # merged, so a partial run only replaces the benchmarks it ran
+        stored = {"results": {}}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as fileObj:
+                stored = json.load(fileObj)
+        stored["environment"] = report["environment"]
+        stored["results"].update(results)
+        with open(args.baseline, "w", encoding="utf-8") as fileObj:
+            json.dump(stored, fileObj, indent=2)
+        return 0
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one.", file=sys.stderr)
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as fileObj:
+        baseline = json.load(fileObj)
+    if baseline.get("environment", {}).get("machine") != report["environment"]["machine"]:
+        print("The baseline was recorded on another kind of machine; compare with care.", file=sys.stderr)
+    # with the JSON on stdout, the table must not end up in it
+    stream = sys.stderr if args.output == "-" else sys.stdout
+    regressed = compare(results, baseline["results"], args.threshold, args.floor, stream)
+    if regressed:
+        print(f"{len(regressed)} benchmarks regressed: {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+this_file = os.path.realpath(__file__)
+wd = os.path.dirname(this_file)
+from configDefault import *
+from api.latency import latency
+from util.batch import runBatch
+from util.database import Database, defaultFilePath
+from util.transfer import exportDatabase, importFiles, openStream
+
+
+def readPrompts(filePath, format):
+    # text: one prompt per line; jsonl: objects with a prompt and an optional id
+    with openStream(filePath, "r") as fileObj:
+        for line in fileObj:
+            if not line.strip():
+                continue
+            if format == "jsonl":
+                record = json.loads(line)
+                yield record.get("id"), record["prompt"]
+            else:
+                yield None, line.rstrip("\n")
+
+
+def chatCommand(args):
+    '''
+    Send every prompt to the chat backend, args.parallel at a time.
+
+    Results are printed as JSON lines, as they complete unless --ordered
+    is given, and stored in the database as one conversation per prompt.
+    '''
+    database = None if args.no_database else Database(args.database or defaultFilePath())
+    # conversation ids follow the GUI's timestamp format, numbered within the run
+    runID = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    ids = {}
+
+    def prompts():
+        for index, (id, prompt) in enumerate(readPrompts(args.input, args.format)):
+            ids[index] = id
+            yield prompt
+
+    def showProgress(progress):
+        print(progress, file=sys.stderr)
+
+    if args.latency_log:
+        latency.openLog(args.latency_log)
+    succeeded = failed = 0
+    try:
+        for result in runBatch(
+            prompts(),
+            parallel=args.parallel,
+            ordered=args.ordered,
+            onProgress=showProgress if args.progress else None,
+        ):
+            result["id"] = ids.pop(result["index"])
+            if "error" in result:
+                failed += 1
+            else:
+                succeeded += 1
+                if database is not None:
+                    conversationID = result["id"] or f"{runID}-{result['index']:06d}"
+                    title = result["prompt"][:50]
+                    with database.transaction():
+                        database.appendMessage(conversationID, title, "user", result["prompt"])
+                        database.appendMessage(conversationID, title, "assistant", result["answer"])
+            sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+    finally:
+        if database is not None:
+            database.close()
+        if args.latency_log:
+            latency.closeLog()
+        if args.metrics:
+            latency.writePrometheus(args.metrics)
+    # a nightly job should notice when some prompts went unanswered
+    args.failed = failed
+    return f"Answered {succeeded} prompts, {failed} failed"
+
+
+def exportCommand(args):
+    database = Database(args.database)
+    try:
+        count = exportDatabase(database, args.output)
+    finally:
+        database.close()
+    return f"Exported {count} conversations"
+
+
+def importCommand(args):
+    database = Database(args.database)
+    try:
+        imported, skipped = importFiles(database, args.inputs, args.replace, args.batch_size)
+    finally:
+        database.close()
+    return f"Imported {imported} conversations, skipped {skipped}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="ChatGPT-GUI without the window"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "chat", help="send prompts to the chat backend and print the answers as JSONL"
+    )
+    command.add_argument(
+        "input", nargs="?", default="-", help="file of prompts, one per line; - or omitted for stdin"
+    )
+    command.add_argument(
+        "--format", choices=("text", "jsonl"), default="text",
+        help='"jsonl" reads objects with a "prompt" and an optional "id"',
+    )
+    command.add_argument(
+        "--parallel", type=int, default=None,
+        help="prompts sent at once, by default the connection pool size; the configured rate limits still apply",
+    )
+    command.add_argument(
+        "--ordered", action="store_true", help="print results in input order"
+    )
+    command.add_argument(
+        "--progress", action="store_true", help="report throughput and ETA on stderr"
+    )
+    command.add_argument(
+        "--database", default="", help=".chat database for the results; the last used one if omitted"
+    )
+    command.add_argument(
+        "--no-database", action="store_true", help="only print the results"
+    )
+    command.add_argument(
+        "--latency-log", default="", help="append the timing of every request to this JSONL file"
+    )
+    command.add_argument(
+        "--metrics", default="", help="write latency histograms to this file in the Prometheus text format"
+    )
+    command.set_defaults(run=chatCommand)
+
+    command = commands.add_parser(
+        "export", help="write a .chat database as JSONL (.gz for compressed NDJSON)"
+    )
+    command.add_argument("database", help=".chat database to read")
+    command.add_argument("output", help="file to write, or - for stdout")
+    command.set_defaults(run=exportCommand)
+
+    command = commands.add_parser(
+        "import", help="add JSONL, NDJSON .gz or .chat files to a .chat database"
+    )
+    command.add_argument("database", help=".chat database to write; created if missing")
+    command.add_argument("inputs", nargs="+", help="files to read, or - for stdin")
+    command.add_argument(
+        "--replace", action="store_true",
+        help="overwrite conversations whose id is already stored instead of skipping them",
+    )
+    command.add_argument(
+        "--batch-size", type=int, default=20000, help="messages written per transaction"
+    )
+    command.set_defaults(run=importCommand)
+
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    summary = args.run(args)
+    print(f"{summary} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    if getattr(args, "failed", 0):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
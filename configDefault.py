@@ -1,4 +1,15 @@
-import config, pprint
+import os
+import sys
+import types
+from util.settings import Settings
+
+# settings live in config.sqlite; an old config.py is moved there once, unexecuted
+settings = Settings(os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.sqlite"))
+settings.migrate(os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.py"))
+# config is built here, never imported from a file, so no config.py runs,
+# not even one that could not be migrated; "import config" elsewhere gets this
+config = sys.modules.setdefault("config", types.ModuleType("config"))
+settings.load(config)
 
 def setConfig():
     thisTranslation = {
@@ -62,6 +73,10 @@ def setConfig():
         'allInputs': 'All Inputs',
         'autoScroll': 'Auto Scroll',
         'enable': 'Enable',
+        'requestLatency': 'Request Latency',
+        'exportMetrics': 'Export Metrics ...',
+        'startLatencyLog': 'Log Requests to JSONL ...',
+        'stopLatencyLog': 'Stop Logging Requests',
     }
     defaultSettings = (
         ('chatGPTApiAudio', 0),
@@ -73,6 +88,26 @@ def setConfig():
         ('chatGPTApiMaxTokens', 512),
         ('chatGPTApiNoOfChoices', 1),
         ('chatGPTApiTemperature', 0.8),
+        ('chatGPTApiPoolSize', 10),
+        ('chatGPTApiConnectTimeout', 5.0),
+        ('chatGPTApiReadTimeout', 120.0),
+        ('chatGPTApiRetryAttempts', 4),
+        ('chatGPTApiRetryBaseDelay', 0.5),
+        ('chatGPTApiRetryMaxDelay', 30.0),
+        ('chatGPTApiCircuitThreshold', 5),
+        ('chatGPTApiCircuitResetTimeout', 30.0),
+        ('chatGPTApiRequestsPerSecond', 3.0),
+        ('chatGPTApiTokensPerMinute', 90000),
+        ('openaiImageRequestsPerSecond', 0.8),
+        ('chatGPTApiCacheEnabled', False),
+        ('chatGPTApiCacheBypass', False),
+        ('chatGPTApiCacheTTL', 7 * 24 * 3600),
+        ('chatGPTApiCacheMaxEntries', 1000),
+        ('chatGPTApiStream', True),
+        ('chatGPTApiStreamInterval', 16),
+        ('chatGPTApiStreamBufferSize', 4096),
+        ('chatGPTTransformers', []),
+        ('predefinedContexts', {'[none]': '', '[custom]': ''}),
         ('darkTheme', True),
         ('developer', False),
         ('enableSystemTray', False),
@@ -83,19 +118,24 @@ def setConfig():
         ('pocketsphinxModelPathBin', ''),
         ('pocketsphinxModelPathDict', ''),
         ('qtLibrary', 'pyside6'),
+        ('chatBackend', 'threads'),
+        ('databaseSynchronous', 'NORMAL'),
         ('regexpSearchEnabled', True),
+        ('fullTextSearchEnabled', True),
         ('includeDuckDuckGoSearchResults', False),
         ('maximumDuckDuckGoSearchResults', 5),
+        ('maximumWorkerThreads', 4),
         ('chatGPTApiContextInAllInputs', False),
+        ('chatGPTApiContextStrategy', 'window'),
         ('chatGPTApiAutoScrolling', True),
         ('thisTranslation', thisTranslation),
     )
     for key, value in defaultSettings:
         if not hasattr(config, key):
-            value = pprint.pformat(value)
-            exec(f"""config.{key} = {value} """)
+            setattr(config, key, value)
     for i in thisTranslation:
         if not i in config.thisTranslation:
             config.thisTranslation[i] = thisTranslation[i]
 
-setConfig()
\ No newline at end of file
+setConfig()
+settings.track(config)
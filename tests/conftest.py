@@ -0,0 +1,8 @@
+import os, sys
+
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, root)
+from configDefault import config, settings
+
+# settings changed by tests are for the test run only
+settings.untrack()
@@ -0,0 +1,34 @@
+import threading
+import time
+
+from api.api import CancelToken, ChatClient
+from benchmarks.stubserver import StubServer, StubHandler
+
+
+def test_cancel_reaches_every_child():
+    parent = CancelToken()
+    children = [parent.child() for _ in range(3)]
+    parent.release(children[0])
+    parent.cancel()
+    assert not children[0].isCancelled()
+    assert all(child.isCancelled() for child in children[1:])
+    # a child taken after the cancel starts out cancelled
+    assert parent.child().isCancelled()
+
+
+class SilentHandler(StubHandler):
+    def do_POST(self):
+        # reads the request, then never answers
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(5)
+
+
+def test_cancel_before_the_headers_arrive():
+    with StubServer(SilentHandler) as server:
+        client = ChatClient(server.url, readTimeout=10)
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        start = time.perf_counter()
+        assert client.chat("hello", token) == ""
+        assert time.perf_counter() - start < 2
+        client.close()
@@ -0,0 +1,74 @@
+import pytest
+
+import util.context
+from util.context import ContextBuilder
+
+
+@pytest.fixture(autouse=True)
+def words(monkeypatch):
+    # one token per word, whether tiktoken is installed or not
+    counted = []
+
+    def countTokens(text):
+        counted.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(util.context, "countTokens", countTokens)
+    return counted
+
+
+def history(builder):
+    return [(role, text) for role, text, _ in builder.messages]
+
+
+def test_window_sends_the_newest_messages_that_fit():
+    builder = ContextBuilder(10, "window")
+    builder.reset([("user", "one two three four", 4), ("assistant", "four five six", 3), ("user", "seven eight", 2)])
+    # 2 for the input leaves 8: the two newest messages fit, the first does not
+    prompt = builder.build("nine ten")
+    assert prompt == "four five six\n\n>>> seven eight\n\n>>> nine ten"
+
+
+def test_summary_says_how_many_messages_were_left_out():
+    builder = ContextBuilder(10, "summary")
+    builder.reset([("user", "one two three four", 4), ("assistant", "four five six", 3), ("user", "seven eight", 2)])
+    # the placeholder costs 4 of the 8 tokens left, so only the newest message fits
+    prompt = builder.build("nine ten")
+    assert prompt == "[2 earlier messages omitted]\n\n>>> seven eight\n\n>>> nine ten"
+    # nothing left out, no placeholder
+    builder.maxTokens = 100
+    assert not builder.build("nine ten").startswith("[")
+
+
+def test_add_forgets_messages_that_can_never_fit():
+    builder = ContextBuilder(10)
+    for text in ("a b c d", "e f g h", "i j k l"):
+        builder.add("user", text)
+    assert builder.omitted == 0 and builder.tokens == 12
+    builder.add("assistant", "m n o p")
+    # without the oldest the rest still fills the budget, so it goes
+    assert builder.omitted == 1 and builder.tokens == 12
+    assert history(builder)[0] == ("user", "e f g h")
+    # the newest message is kept, however large
+    builder.add("user", " ".join("x" * 20))
+    assert history(builder) == [("user", " ".join("x" * 20))]
+    assert builder.omitted == 4
+
+
+def test_add_reuses_the_count_of_the_built_input(words):
+    builder = ContextBuilder(100)
+    builder.build("how are you")
+    words.clear()
+    assert builder.add("user", "how are you") == 3
+    assert words == []
+    # a different text is counted
+    assert builder.add("assistant", "fine thanks") == 2
+    assert words == ["fine thanks"]
+
+
+def test_context_goes_first_only_when_the_conversation_starts():
+    builder = ContextBuilder(100)
+    assert builder.build("hi", "be brief") == "be brief\n\n>>> hi"
+    builder.add("user", "hi")
+    assert builder.build("again", "be brief") == ">>> hi\n\n>>> again"
+    assert builder.build("again", "be brief", contextInAllInputs=True) == "be brief\n\n>>> hi\n\n>>> again"
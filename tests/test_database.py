@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+import pytest
+import config
+from util.database import Database, DatabaseService
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "test.chat"))
+    if not database.fullTextIndex:
+        pytest.skip("SQLite is built without FTS5")
+    yield database
+    database.close()
+
+
+def triggers(database):
+    database.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'messages_%'")
+    return sorted(name for (name,) in database.cursor.fetchall())
+
+
+def indexed(database, word):
+    database.cursor.execute("SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?", (word,))
+    return [rowid for (rowid,) in database.cursor.fetchall()]
+
+
+def test_failed_import_batch_keeps_full_text_index(database):
+    records = [
+        {"id": "a", "title": "a", "messages": [{"role": "user", "text": "apple"}]},
+        # a value SQLite cannot bind makes the batch fail halfway
+        {"id": "b", "title": "b", "messages": [{"role": "user", "text": {"not": "text"}}]},
+    ]
+    with pytest.raises(sqlite3.Error):
+        database.importRecords(records)
+    assert triggers(database) == ["messages_ad", "messages_ai", "messages_au"]
+    database.cursor.execute("SELECT COUNT(*) FROM data")
+    assert database.cursor.fetchone() == (0,)
+    database.appendMessage("c", "c", "user", "banana")
+    assert len(indexed(database, "banana")) == 1
+    database.delete("c")
+    assert indexed(database, "banana") == []
+
+
+def test_full_text_search_finds_partial_words(database, monkeypatch):
+    monkeypatch.setattr(config, "fullTextSearchEnabled", True)
+    monkeypatch.setattr(config, "regexpSearchEnabled", False)
+    database.appendMessage("a", "greeting", "user", "hello there")
+    database.appendMessage("b", "farewell", "user", "goodbye")
+    assert database.search("", "hel") == [("a", "greeting")]
+    assert database.search("gree", "there") == [("a", "greeting")]
+    # a regular expression is left to the scan
+    monkeypatch.setattr(config, "regexpSearchEnabled", True)
+    assert database.search("", "^good.*e$") == [("b", "farewell")]
+
+
+def test_migration_backs_up_old_transcripts(tmp_path):
+    filePath = str(tmp_path / "old.chat")
+    connection = sqlite3.connect(filePath)
+    connection.execute("CREATE TABLE data (id TEXT PRIMARY KEY, title TEXT, content TEXT)")
+    connection.execute("INSERT INTO data VALUES ('a', 'hi', '>>> hi\n\nhello')")
+    connection.commit()
+    connection.close()
+    database = Database(filePath)
+    assert database.getMessages("a")[0][:2] == ("user", "hi")
+    database.close()
+    backup = sqlite3.connect(filePath + ".v0.bak")
+    assert backup.execute("SELECT content FROM data").fetchall() == [(">>> hi\n\nhello",)]
+    backup.close()
+
+
+def test_full_text_search_matches_phrases_and_snippets(database, monkeypatch):
+    monkeypatch.setattr(config, "fullTextSearchEnabled", True)
+    monkeypatch.setattr(config, "regexpSearchEnabled", False)
+    database.appendMessage("a", "first", "user", "question 13 about apples")
+    database.appendMessage("b", "second", "user", "question 130 about pears")
+    database.appendMessage("c", "third", "user", "13 question out of order")
+    assert sorted(database.search("", "question 13")) == [("a", "first"), ("b", "second")]
+    assert database.search("sec", "question 13") == [("b", "second")]
+    results = database.fullTextSearch("", '"apples"*')
+    assert results == [("a", "first", "question 13 about [apples]")]
+
+
+def test_service_coalesces_only_inserts_nothing_came_after(tmp_path):
+    service = DatabaseService(str(tmp_path / "test.chat"))
+    release = threading.Event()
+    saved = []
+
+    def listener(event, *args):
+        # holds the service thread at the first save, so the rest queue up
+        if event == "saved":
+            saved.append(args[0])
+            if args[0] == "hold":
+                release.wait(5)
+
+    service.listeners.append(listener)
+    service.submit("insert", "hold", "hold", ">>> hold")
+    first = service.submit("insert", "a", "a one", ">>> a one")
+    second = service.submit("insert", "a", "a two", ">>> a two")
+    service.submit("insert", "b", "b", ">>> b one")
+    service.submit("appendMessage", "b", "b", "user", "b appended")
+    last = service.submit("insert", "b", "b", ">>> b two")
+    release.set()
+    last.result(5)
+    assert first.result(5) is None and second.result(5) is None
+    # a was written once, with the newer transcript
+    assert saved.count("a") == 1
+    assert [message[:2] for message in service.submit("getMessages", "a").result(5)] == [("user", "a two")]
+    # b's second insert came after the append, so it ran last and on its own
+    assert [message[:2] for message in service.submit("getMessages", "b").result(5)] == [("user", "b two")]
+    service.close()
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+pytest.importorskip("PySide6")
+from PySide6.QtWidgets import QApplication
+from util.database import DatabaseService
+
+app = QApplication.instance() or QApplication([])
+from QChatGpt import ConversationListModel
+
+
+@pytest.fixture
+def model(tmp_path):
+    service = DatabaseService(str(tmp_path / "test.chat"))
+    model = ConversationListModel(service)
+    # as after the first page, newest first
+    model.rows = [("2023-03", "march"), ("2023-01", "january")]
+    model.exhausted = True
+    yield model
+    service.close()
+
+
+def test_find_row_keeps_newest_first(model):
+    assert model.findRow("2023-04") == 0
+    assert model.findRow("2023-03") == 0
+    assert model.findRow("2023-02") == 1
+    assert model.findRow("2022-12") == 2
+
+
+def test_notifications_insert_update_and_remove_rows(model):
+    inserted, changed, removed = [], [], []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append(first))
+    model.dataChanged.connect(lambda topLeft, bottomRight: changed.append(topLeft.row()))
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append(first))
+    model.databaseChanged("saved", "2023-02", "february")
+    assert inserted == [1]
+    model.databaseChanged("saved", "2023-03", "march, renamed")
+    assert changed == [0]
+    assert model.rows == [("2023-03", "march, renamed"), ("2023-02", "february"), ("2023-01", "january")]
+    model.databaseChanged("deleted", ("2023-02", "2022-01"))
+    assert removed == [1]
+    assert [row[0] for row in model.rows] == ["2023-03", "2023-01"]
+
+
+def test_rows_past_the_loaded_pages_wait_for_fetch_more(model):
+    model.exhausted = False
+    model.databaseChanged("saved", "2022-06", "june")
+    assert len(model.rows) == 2
+    model.databaseChanged("saved", "2023-06", "june")
+    assert model.rows[0] == ("2023-06", "june")
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+import requests
+
+from api.api import CancelToken, classifyError
+from api.resilience import RetryPolicy, CircuitBreaker, Cancelled
+
+
+def halfOpen(policy):
+    breaker = policy.breaker
+    breaker.state = CircuitBreaker.OPEN
+    breaker.openedAt = -breaker.resetTimeout
+    return breaker
+
+
+def test_cancelled_calls_leave_the_breaker_alone():
+    policy = RetryPolicy("test", classifyError, failureThreshold=2, baseDelay=0)
+    token = CancelToken()
+    token.cancel()
+
+    def aborted():
+        # what a request fails with once its socket was shut down
+        raise requests.ConnectionError("aborted")
+
+    for _ in range(3):
+        with pytest.raises(requests.ConnectionError):
+            policy.call(aborted, cancelToken=token)
+    assert policy.breaker.state == CircuitBreaker.CLOSED
+    assert policy.breaker.failures == 0
+
+    breaker = halfOpen(policy)
+
+    def limited():
+        raise Cancelled("cancelled while waiting for the rate limiter")
+
+    with pytest.raises(Cancelled):
+        policy.call(limited)
+    # still half-open, and the next call is let through as the trial
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert policy.call(lambda: "ok") == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_interrupted_trial_is_released():
+    policy = RetryPolicy("test", classifyError)
+    breaker = halfOpen(policy)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        policy.call(interrupted)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.trialRunning
+
+    async def cancelledTask():
+        raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(policy.callAsync(cancelledTask))
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.trialRunning
@@ -0,0 +1,71 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import types
+
+from util.settings import Settings
+
+
+def stored(settings):
+    with settings.lock:
+        return dict(settings.connection.execute("SELECT key, value FROM settings").fetchall())
+
+
+def test_migrate_keeps_unreadable_config(tmp_path):
+    configFile = tmp_path / "config.py"
+    configFile.write_text("fontSize = 14\nbroken = (\n", encoding="utf-8")
+    settings = Settings(str(tmp_path / "config.sqlite"))
+    settings.migrate(str(configFile))
+    assert configFile.read_text(encoding="utf-8").startswith("fontSize")
+    assert not (tmp_path / "config.py.bak").exists()
+    assert settings.isEmpty()
+
+    # a value literal_eval fails on is left out, the rest is migrated
+    configFile.write_text("fontSize = 16\nunhashable = {[1]: 2}\n", encoding="utf-8")
+    settings.migrate(str(configFile))
+    assert stored(settings) == {"fontSize": "16"}
+    settings.close()
+
+
+def test_changes_are_written_by_one_flusher(tmp_path):
+    settings = Settings(str(tmp_path / "config.sqlite"), delay=0.05)
+    config = types.ModuleType("config")
+    config.fontSize = 14
+    config.history = {}
+    settings.track(config)
+    threads = threading.active_count()
+    for size in range(15, 25):
+        config.fontSize = size
+    assert threading.active_count() <= threads + 1
+    deadline = time.monotonic() + 5
+    while stored(settings).get("fontSize") != "24" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stored(settings) == {"fontSize": "24"}
+    # changed in place, so only the sweep at close sees it
+    config.history["a"] = 1
+    settings.close()
+    reopened = Settings(str(tmp_path / "config.sqlite"))
+    assert stored(reopened)["history"] == '{"a": 1}'
+    reopened.close()
+
+
+def test_startup_survives_unparsable_config(tmp_path):
+    # configDefault in a tree of its own, beside a config.py that cannot be parsed
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    shutil.copy(os.path.join(root, "configDefault.py"), tmp_path)
+    (tmp_path / "util").mkdir()
+    shutil.copy(os.path.join(root, "util", "settings.py"), tmp_path / "util")
+    (tmp_path / "config.py").write_text("fontSize = 20\nbroken = (\nraise SystemExit(3)\n", encoding="utf-8")
+    result = subprocess.run(
+        [sys.executable, "-c", "import configDefault, config; print(config.fontSize)"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    # the defaults are in place and the file is kept for the user to fix
+    assert result.stdout.splitlines()[-1] == "14"
+    assert (tmp_path / "config.py").exists()
@@ -0,0 +1,137 @@
+import config, sys, traceback, asyncio, threading
+from api.asyncapi import AsyncChatClient, classifyError
+from util.backend import getRetryPolicy, getChatLimiter, getCachedAnswer, cacheAnswer
+from util.worker import WorkerSignals, StreamBuffer
+
+
+class EventLoopThread:
+    '''
+    Runs one asyncio event loop in a daemon thread.
+
+    Every async conversation is scheduled on this loop; results travel back
+    to the GUI thread through queued Qt signals, just like Worker's do.
+    '''
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+eventLoop = None
+asyncChatClient = None
+
+
+def getEventLoop():
+    global eventLoop
+    if eventLoop is None:
+        eventLoop = EventLoopThread()
+    return eventLoop
+
+
+def getAsyncChatClient():
+    global asyncChatClient
+    if asyncChatClient is None:
+        asyncChatClient = AsyncChatClient(
+            poolSize=config.chatGPTApiPoolSize,
+            connectTimeout=config.chatGPTApiConnectTimeout,
+            readTimeout=config.chatGPTApiReadTimeout,
+            retry=getRetryPolicy("chat", classifyError),
+            limiter=getChatLimiter(),
+            estimatedTokens=config.chatGPTApiMaxTokens,
+        )
+    return asyncChatClient
+
+
+class AsyncWorker:
+    '''
+    Coroutine counterpart of Worker
+
+    Runs the coroutine function on the shared event loop and reports
+    through the same WorkerSignals. cancel() cancels the task; it is safe
+    to call from the GUI thread at any time.
+
+    :param fn: coroutine function to run; receives progress_callback
+    '''
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.task = None
+        self.cancelled = False
+        self.kwargs["progress_callback"] = self.signals.progress
+
+    def start(self):
+        getEventLoop().submit(self.run())
+
+    def cancel(self):
+        getEventLoop().loop.call_soon_threadsafe(self.cancelTask)
+
+    def cancelTask(self):
+        # runs on the loop thread, so it cannot race with run() starting
+        self.cancelled = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        self.task = asyncio.current_task()
+        try:
+            result = "" if self.cancelled else await self.fn(*self.args, **self.kwargs)
+        except asyncio.CancelledError:
+            self.signals.result.emit("")
+        except Exception:
+            traceback.print_exc()
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit((exctype, value, traceback.format_exc()))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.task = None
+            self.signals.finished.emit()
+
+
+class AsyncChatGPTResponse:
+
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+
+    async def getResponse(self, messages, context, progress_callback):
+        answer = getCachedAnswer(messages, context)
+        if answer is not None:
+            return answer
+        client = getAsyncChatClient()
+        # a cancelled task ends the request; whatever arrived is kept
+        chunks = []
+        try:
+            if not config.chatGPTApiStream:
+                chunks.append(await client.chat(messages))
+            else:
+                async for text in client.stream(messages):
+                    chunks.append(text)
+                    progress_callback.emit(text)
+        except asyncio.CancelledError:
+            return "".join(chunks)
+        answer = "".join(chunks)
+        cacheAnswer(messages, context, answer)
+        return answer
+
+    def workOnGetResponse(self, messages):
+        worker = AsyncWorker(self.getResponse, messages, self.parent.getContext())
+        buffer = StreamBuffer(
+            config.chatGPTApiStreamInterval, config.chatGPTApiStreamBufferSize, self.parent
+        )
+        worker.signals.progress.connect(buffer.append)
+        buffer.flushed.connect(self.parent.printStream)
+        worker.signals.result.connect(buffer.flush)
+        worker.signals.result.connect(self.parent.processResponse)
+        worker.signals.error.connect(self.parent.processError)
+        worker.signals.finished.connect(buffer.flush)
+        worker.signals.finished.connect(buffer.deleteLater)
+        worker.start()
+        return worker
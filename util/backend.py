@@ -0,0 +1,146 @@
+import os
+import threading
+import config
+from api.api import getClient, classifyError
+from api.resilience import RetryPolicy
+from api.ratelimit import RateLimiter
+from api.cache import ResponseCache
+
+
+def getRetryPolicy(name, classify):
+    return RetryPolicy(
+        name,
+        classify,
+        maxAttempts=config.chatGPTApiRetryAttempts,
+        baseDelay=config.chatGPTApiRetryBaseDelay,
+        maxDelay=config.chatGPTApiRetryMaxDelay,
+        failureThreshold=config.chatGPTApiCircuitThreshold,
+        resetTimeout=config.chatGPTApiCircuitResetTimeout,
+    )
+
+
+chatRetryPolicy = None
+chatLimiter = None
+imageLimiter = None
+# guards the three above; two limiters would each allow the full budget
+backendLock = threading.Lock()
+
+
+def getChatLimiter():
+    # one budget for the chat backend, whichever client spends it
+    global chatLimiter
+    if chatLimiter is None:
+        with backendLock:
+            if chatLimiter is None:
+                chatLimiter = RateLimiter(
+                    "chat", config.chatGPTApiRequestsPerSecond, config.chatGPTApiTokensPerMinute
+                )
+    return chatLimiter
+
+
+def getImageLimiter():
+    global imageLimiter
+    if imageLimiter is None:
+        with backendLock:
+            if imageLimiter is None:
+                imageLimiter = RateLimiter("image", config.openaiImageRequestsPerSecond)
+    return imageLimiter
+
+
+def getChatClient():
+    global chatRetryPolicy
+    if chatRetryPolicy is None:
+        with backendLock:
+            if chatRetryPolicy is None:
+                chatRetryPolicy = getRetryPolicy("chat", classifyError)
+    return getClient(
+        poolSize=config.chatGPTApiPoolSize,
+        connectTimeout=config.chatGPTApiConnectTimeout,
+        readTimeout=config.chatGPTApiReadTimeout,
+        retry=chatRetryPolicy,
+        limiter=getChatLimiter(),
+        estimatedTokens=config.chatGPTApiMaxTokens,
+    )
+
+
+responseCache = None
+responseCacheLock = threading.Lock()
+
+
+def getResponseCache():
+    # kept beside the open .chat database; None unless the cache is enabled
+    global responseCache
+    if not config.chatGPTApiCacheEnabled:
+        return None
+    databaseDirectory = os.path.dirname(os.path.abspath(config.chatGPTApiLastChatDatabase))
+    filePath = os.path.join(databaseDirectory, "responses.cache")
+    cache = responseCache
+    if cache is not None and cache.filePath == filePath:
+        return cache
+    with responseCacheLock:
+        # checked again, so that racing threads open one cache and close none twice
+        if responseCache is None or responseCache.filePath != filePath:
+            if responseCache is not None:
+                responseCache.close()
+            responseCache = ResponseCache(
+                filePath, config.chatGPTApiCacheTTL, config.chatGPTApiCacheMaxEntries
+            )
+        return responseCache
+
+
+def getCacheKey(messages, context):
+    return ResponseCache.key(
+        messages, config.chatGPTApiModel, config.chatGPTApiTemperature, context
+    )
+
+
+def getContext():
+    if not config.chatGPTApiPredefinedContext in config.predefinedContexts:
+        config.chatGPTApiPredefinedContext = "[none]"
+    if config.chatGPTApiPredefinedContext == "[none]":
+        context = ""
+    elif config.chatGPTApiPredefinedContext == "[custom]":
+        context = config.chatGPTApiContext
+    else:
+        context = config.predefinedContexts[config.chatGPTApiPredefinedContext]
+    return context
+
+
+def getCachedAnswer(messages, context):
+    # None when there is no answer, the cache is off or it is bypassed
+    cache = getResponseCache()
+    if cache is None or config.chatGPTApiCacheBypass:
+        return None
+    return cache.get(getCacheKey(messages, context))
+
+
+def cacheAnswer(messages, context, answer):
+    # stored even when bypassed, so that a bypass refreshes the entry
+    cache = getResponseCache()
+    if cache is not None and answer:
+        cache.put(getCacheKey(messages, context), answer)
+
+
+def getAnswer(messages, context, cancelToken=None, onChunk=None):
+    '''
+    Ask the chat backend, through the response cache when it is enabled.
+
+    With streaming on, onChunk receives each piece of text as it arrives.
+    On cancel the answer so far is returned, and not cached.
+    '''
+    answer = getCachedAnswer(messages, context)
+    if answer is not None:
+        return answer
+    client = getChatClient()
+    if not config.chatGPTApiStream:
+        answer = client.chat(messages, cancelToken)
+    else:
+        chunks = []
+        for text in client.stream(messages, cancelToken):
+            chunks.append(text)
+            if onChunk is not None:
+                onChunk(text)
+        answer = "".join(chunks)
+    if cancelToken is None or not cancelToken.isCancelled():
+        cacheAnswer(messages, context, answer)
+    return answer
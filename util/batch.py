@@ -0,0 +1,146 @@
+import time
+import config
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from api.api import CancelToken
+from api.latency import setQueueWait
+from util.backend import getAnswer, getContext
+
+
+class BatchProgress:
+    '''
+    Counts finished prompts of a batch and derives throughput and ETA.
+
+    :param total: number of prompts, or None when it is not known up front
+    '''
+
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def add(self, result):
+        self.done += 1
+        if "error" in result:
+            self.failed += 1
+
+    def rate(self):
+        # prompts per second since the batch started
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        # seconds left, or None while it cannot be estimated
+        rate = self.rate()
+        if self.total is None or not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def __str__(self):
+        eta = self.eta()
+        remaining = "?" if eta is None else time.strftime("%H:%M:%S", time.gmtime(eta))
+        return (
+            f"{self.done}/{'?' if self.total is None else self.total} done, "
+            f"{self.failed} failed, {self.rate():.2f} prompts/s, ETA {remaining}"
+        )
+
+
+def runPrompt(index, prompt, context, cancelToken, submitted):
+    start = time.perf_counter()
+    setQueueWait(start - submitted)
+    result = {"index": index, "prompt": prompt}
+    # the prompts in flight share cancelToken, but each needs its own response aborted
+    token = cancelToken.child()
+    try:
+        result["answer"] = getAnswer(prompt, context, token)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    finally:
+        cancelToken.release(token)
+        setQueueWait(None)
+    if cancelToken.isCancelled():
+        result["cancelled"] = True
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def runBatch(
+    prompts,
+    context=None,
+    parallel=None,
+    ordered=True,
+    cancelToken=None,
+    onProgress=None,
+    total=None,
+):
+    '''
+    Send many prompts to the chat backend and yield a result for each.
+
+    Results are dicts of index, prompt, seconds and either answer or
+    error. With ordered they come in submission order, otherwise as soon
+    as they complete. At most parallel requests run at once, all on the
+    shared pooled client, and only twice that many prompts are taken from
+    prompts ahead of the results, so an iterator of any length runs in
+    bounded memory. onProgress receives a BatchProgress after every result.
+
+    Cancelling cancelToken, or closing the generator early, drops the
+    queued prompts and aborts those in flight.
+
+    :param context: context for the cache key; the configured one by default
+    :param parallel: concurrent requests; defaults to the connection pool size
+    :param total: number of prompts for the ETA, when prompts has no len()
+    '''
+    if context is None:
+        context = getContext()
+    if parallel is None:
+        # more threads than pooled connections would open throwaway connections
+        parallel = config.chatGPTApiPoolSize
+    if cancelToken is None:
+        cancelToken = CancelToken()
+    if total is None and hasattr(prompts, "__len__"):
+        total = len(prompts)
+    progress = BatchProgress(total)
+    window = parallel * 2
+    prompts = enumerate(prompts)
+    pending = set()
+    finished = {}
+    submitted = nextIndex = 0
+    executor = ThreadPoolExecutor(max_workers=parallel)
+    try:
+        while True:
+            # in order, a slow prompt holds back the ones after it; the window
+            # counts those too, so they cannot pile up
+            while not cancelToken.isCancelled() and (
+                submitted - nextIndex if ordered else len(pending)
+            ) < window:
+                item = next(prompts, None)
+                if item is None:
+                    break
+                index, prompt = item
+                pending.add(
+                    executor.submit(
+                        runPrompt, index, prompt, context, cancelToken, time.perf_counter()
+                    )
+                )
+                submitted += 1
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda future: future.result()["index"]):
+                result = future.result()
+                progress.add(result)
+                if onProgress is not None:
+                    onProgress(progress)
+                if ordered:
+                    finished[result["index"]] = result
+                else:
+                    yield result
+            while nextIndex in finished:
+                yield finished.pop(nextIndex)
+                nextIndex += 1
+    finally:
+        if pending:
+            for future in pending:
+                future.cancel()
+            cancelToken.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,83 @@
+import collections
+from util.database import joinTranscript
+from util.tokens import countTokens
+
+
+class ContextBuilder:
+    '''
+    Assembles the prompt for the next turn from the conversation so far.
+
+    Messages are kept with their token counts, so each turn only counts
+    the new message. build() sends the newest messages that fit into
+    maxTokens together with the context and the new input; older ones are
+    dropped ("window") or replaced by a line saying how many were left
+    out ("summary"). Messages that could never fit are forgotten as new
+    ones arrive, so memory stays bounded too.
+
+    :param maxTokens: token budget of the whole prompt
+    :param strategy: "window" or "summary"
+    '''
+    placeholder = "[{0} earlier messages omitted]"
+
+    def __init__(self, maxTokens, strategy="window"):
+        self.maxTokens = maxTokens
+        self.strategy = strategy
+        self.reset()
+
+    def reset(self, messages=()):
+        '''Start over with messages as (role, text) or (role, text, tokens).'''
+        self.messages = collections.deque()
+        self.tokens = 0
+        self.omitted = 0
+        self.pending = None
+        for message in messages:
+            self.add(*message)
+
+    def count(self, text):
+        # build() counted the input it was given; add() then reuses that count
+        if self.pending is not None and self.pending[0] == text:
+            return self.pending[1]
+        return countTokens(text)
+
+    def add(self, role, text, tokens=None):
+        if tokens is None:
+            tokens = self.count(text)
+        self.messages.append((role, text, tokens))
+        self.tokens += tokens
+        while len(self.messages) > 1 and self.tokens - self.messages[0][2] >= self.maxTokens:
+            self.tokens -= self.messages.popleft()[2]
+            self.omitted += 1
+        return tokens
+
+    def isNew(self):
+        return not self.messages and not self.omitted
+
+    def build(self, userInput, context="", contextInAllInputs=False):
+        '''
+        The prompt for userInput, as a transcript like the one on screen.
+
+        The context goes first, in every prompt with contextInAllInputs,
+        otherwise only when the conversation starts.
+        '''
+        if not (contextInAllInputs or self.isNew()):
+            context = ""
+        inputTokens = self.count(userInput)
+        self.pending = (userInput, inputTokens)
+        budget = self.maxTokens - inputTokens
+        if context:
+            budget -= countTokens(context)
+        if self.strategy == "summary" and (self.omitted or self.tokens > budget):
+            budget -= countTokens(self.placeholder.format(len(self.messages) + self.omitted))
+        history = []
+        for role, text, tokens in reversed(self.messages):
+            if tokens > budget:
+                break
+            budget -= tokens
+            history.append((role, text))
+        history.reverse()
+        parts = [context] if context else []
+        omitted = self.omitted + len(self.messages) - len(history)
+        if omitted and self.strategy == "summary":
+            parts.append(self.placeholder.format(omitted))
+        parts.append(joinTranscript(history + [("user", userInput)]))
+        return "\n\n".join(parts)
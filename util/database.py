@@ -0,0 +1,643 @@
+import contextlib
+import functools
+import os
+import queue
+import re
+import sqlite3
+import threading
+from concurrent.futures import Future
+import config
+from util.tokens import countTokens
+
+wd = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def defaultFilePath():
+    if config.chatGPTApiLastChatDatabase and os.path.isfile(config.chatGPTApiLastChatDatabase):
+        return config.chatGPTApiLastChatDatabase
+    return os.path.join(wd, "chats", "default.chat")
+
+
+@functools.lru_cache(maxsize=64)
+def compileRegexp(expr):
+    # one compile per pattern, not per row; a bad pattern is reported once
+    try:
+        return re.compile(expr, flags=re.IGNORECASE)
+    except re.error as error:
+        print(f"Invalid regular expression {expr!r}: {error}")
+        return None
+
+
+def fullTextQuery(text):
+    '''
+    FTS5 query for plain search input, None if it is not just words.
+
+    The words become one phrase whose last word is a prefix, so "hel"
+    finds "hello" and "question 13" finds "question 13" and "question
+    130" but not "13 question", much as a substring search would. Unlike
+    one, it cannot match inside a word: "ello" does not find "hello".
+    Anything but words, e.g. a regular expression, is left to the scan.
+    '''
+    if not re.fullmatch(r"[\w\s'-]+", text):
+        return None
+    words = text.split()
+    return '"{}"*'.format(" ".join(words)) if words else None
+
+
+def regexp(expr, item):
+    # REGEXP callback for SQLite; None is SQL NULL, i.e. no match
+    if not item:
+        return None
+    reg = compileRegexp(expr)
+    if reg is None:
+        return None
+    return reg.search(item) is not None
+
+
+def splitTranscript(content):
+    # ">>> " paragraphs are prompts, the text after each one is its answer;
+    # joinTranscript(splitTranscript(content)) gives content back unchanged
+    messages = []
+    for block in re.split("\n\n(?=>>> )", content):
+        if block.startswith(">>> "):
+            prompt, separator, answer = block[4:].partition("\n\n")
+            messages.append(("user", prompt))
+            if separator:
+                messages.append(("assistant", answer))
+        elif block:
+            messages.append(("assistant", block))
+    return messages
+
+
+def joinTranscript(messages):
+    return "\n\n".join(
+        f">>> {text}" if role == "user" else text for role, text in messages
+    )
+
+
+class Database:
+    # 0: whole transcript in data.content; 1: one row per message in messages;
+    # 2: messages.tokens caches the token count of each message
+    schemaVersion = 2
+    synchronousLevels = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+    def __init__(self, filePath=""):
+        self.filePath = filePath if filePath else defaultFilePath()
+        self.connection = sqlite3.connect(self.filePath)
+        self.connection.create_function("REGEXP", 2, regexp)
+        self.cursor = self.connection.cursor()
+        self.transactionDepth = 0
+        # listeners are called as listener(event, *args) once a change is committed:
+        # ("saved", id, title), ("deleted", ids), ("cleared",) or ("imported", count)
+        self.listeners = []
+        self.pendingChanges = []
+        # with WAL, NORMAL only syncs at checkpoints instead of on every commit
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        synchronous = str(config.databaseSynchronous).upper()
+        if synchronous in self.synchronousLevels:
+            self.cursor.execute(f"PRAGMA synchronous={synchronous}")
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS data (id TEXT PRIMARY KEY, title TEXT, content TEXT)"
+        )
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS messages (conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, text TEXT NOT NULL, created_at TEXT DEFAULT CURRENT_TIMESTAMP, tokens INTEGER, PRIMARY KEY (conversation_id, seq))"
+        )
+        self.migrate()
+        self.fullTextIndex = self.createFullTextIndex()
+        self.connection.commit()
+
+    def migrate(self):
+        self.cursor.execute("PRAGMA user_version")
+        (version,) = self.cursor.fetchone()
+        if version >= self.schemaVersion:
+            return
+        self.cursor.execute("PRAGMA table_info(messages)")
+        if "tokens" not in (column[1] for column in self.cursor.fetchall()):
+            # counted again as conversations are opened
+            self.cursor.execute("ALTER TABLE messages ADD COLUMN tokens INTEGER")
+        if version < 1:
+            self.backUp(f"{self.filePath}.v{version}.bak")
+            # the full-text index of version 0 covered data.content, which is emptied below
+            for trigger in ("data_ai", "data_ad", "data_au"):
+                self.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            self.cursor.execute("DROP TABLE IF EXISTS data_fts")
+            self.cursor.execute("SELECT id, content FROM data WHERE content IS NOT NULL")
+            for id, content in self.cursor.fetchall():
+                self.writeMessages(id, splitTranscript(content))
+            self.cursor.execute("UPDATE data SET content = NULL")
+        self.cursor.execute(f"PRAGMA user_version = {self.schemaVersion}")
+
+    def backUp(self, backupPath):
+        # the transcripts as they were, before a migration rewrites them; an
+        # earlier backup is never overwritten
+        self.cursor.execute("SELECT 1 FROM data WHERE content IS NOT NULL LIMIT 1")
+        if self.cursor.fetchone() is None or os.path.exists(backupPath):
+            return
+        backup = sqlite3.connect(backupPath)
+        try:
+            self.connection.backup(backup)
+        finally:
+            backup.close()
+
+    def createFullTextIndex(self):
+        # data_fts and messages_fts index the rows of data and messages without
+        # storing a second copy; the triggers keep them in step with every change
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        exists = self.cursor.fetchone()
+        try:
+            self.cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS data_fts USING fts5(title, content='data', prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+            )
+            self.cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+            )
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; search() scans with LIKE or REGEXP instead
+            return False
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS data_ai AFTER INSERT ON data BEGIN "
+            "INSERT INTO data_fts (rowid, title) VALUES (new.rowid, new.title); END"
+        )
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS data_ad AFTER DELETE ON data BEGIN "
+            "INSERT INTO data_fts (data_fts, rowid, title) VALUES ('delete', old.rowid, old.title); END"
+        )
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS data_au AFTER UPDATE OF title ON data BEGIN "
+            "INSERT INTO data_fts (data_fts, rowid, title) VALUES ('delete', old.rowid, old.title); "
+            "INSERT INTO data_fts (rowid, title) VALUES (new.rowid, new.title); END"
+        )
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN "
+            "INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text); END"
+        )
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN "
+            "INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text); END"
+        )
+        self.cursor.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF text ON messages BEGIN "
+            "INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text); "
+            "INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text); END"
+        )
+        if not exists:
+            self.cursor.execute("INSERT INTO data_fts (data_fts) VALUES ('rebuild')")
+            self.cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        return True
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Group writes into a single commit.
+
+        Inside ``with database.transaction():`` insert, appendMessage,
+        delete and clear do not commit; the outermost block commits once
+        at the end, or rolls everything back if it raises.
+        '''
+        self.transactionDepth += 1
+        try:
+            yield self
+        except BaseException:
+            self.transactionDepth -= 1
+            if not self.transactionDepth:
+                self.connection.rollback()
+                self.pendingChanges = []
+            raise
+        self.transactionDepth -= 1
+        self.commit()
+
+    def commit(self):
+        if not self.transactionDepth:
+            self.connection.commit()
+            changes, self.pendingChanges = self.pendingChanges, []
+            for change in changes:
+                for listener in self.listeners:
+                    listener(*change)
+
+    def notify(self, *change):
+        # held back until commit, so listeners never see rolled back changes
+        self.pendingChanges.append(change)
+
+    def writeMessages(self, id, messages):
+        # messages that did not change are left alone, so neither their pages
+        # nor their full-text entries are rewritten
+        self.cursor.executemany(
+            "INSERT INTO messages (conversation_id, seq, role, text) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (conversation_id, seq) DO UPDATE SET role = excluded.role, text = excluded.text, tokens = NULL "
+            "WHERE role IS NOT excluded.role OR text IS NOT excluded.text",
+            ((id, seq, role, text) for seq, (role, text) in enumerate(messages)),
+        )
+        self.cursor.execute(
+            "DELETE FROM messages WHERE conversation_id = ? AND seq >= ?",
+            (id, len(messages)),
+        )
+
+    def insert(self, id, title, content):
+        # saves a whole transcript, e.g. after it was edited by hand
+        self.cursor.execute(
+            "INSERT INTO data (id, title) VALUES (?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET title = excluded.title WHERE title IS NOT excluded.title",
+            (id, title),
+        )
+        if self.cursor.rowcount:
+            self.notify("saved", id, title)
+        self.writeMessages(id, splitTranscript(content))
+        self.commit()
+
+    def appendMessage(self, id, title, role, text, tokens=None):
+        # one turn costs one row, however long the conversation is;
+        # title only applies when this starts a new conversation
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO data (id, title) VALUES (?, ?)", (id, title)
+        )
+        if self.cursor.rowcount:
+            self.notify("saved", id, title)
+        self.cursor.execute(
+            "INSERT INTO messages (conversation_id, seq, role, text, tokens) VALUES (?, (SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE conversation_id = ?), ?, ?, ?)",
+            (id, id, role, text, tokens),
+        )
+        self.commit()
+
+    def listConversations(self, before=None, limit=-1):
+        # newest first, paged by key on the primary key index rather than by OFFSET
+        if before is None:
+            self.cursor.execute(
+                "SELECT id, title FROM data ORDER BY id DESC LIMIT ?", (limit,)
+            )
+        else:
+            self.cursor.execute(
+                "SELECT id, title FROM data WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (before, limit),
+            )
+        return self.cursor.fetchall()
+
+    def backup(self, filePath):
+        # a plain file copy would miss pages still waiting in the WAL file
+        target = sqlite3.connect(filePath)
+        with target:
+            self.connection.backup(target)
+        target.close()
+
+    def close(self):
+        self.connection.close()
+
+    def exportRecords(self):
+        '''
+        Yield every conversation as a dict of id, title and messages, in id order.
+
+        Rows are read from one cursor as they are consumed, so memory holds
+        a single conversation however large the database is. Messages are
+        dicts of role, text and created_at.
+        '''
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "SELECT data.id, data.title, messages.role, messages.text, messages.created_at "
+            "FROM data LEFT JOIN messages ON messages.conversation_id = data.id "
+            "ORDER BY data.id, messages.seq"
+        )
+        record = None
+        for id, title, role, text, createdAt in cursor:
+            if record is None or record["id"] != id:
+                if record is not None:
+                    yield record
+                record = {"id": id, "title": title, "messages": []}
+            if role is not None:
+                record["messages"].append({"role": role, "text": text, "created_at": createdAt})
+        if record is not None:
+            yield record
+        cursor.close()
+
+    def importRecords(self, records, replace=False, batchSize=20000):
+        '''
+        Store conversations given as exportRecords yields them; returns (imported, skipped).
+
+        A record may carry a transcript in content instead of messages.
+        Conversations are deduplicated by id: an id already stored is
+        skipped, or overwritten when replace is true. Records are written
+        with executemany, one transaction per batchSize messages.
+        '''
+        imported = skipped = 0
+        batch, size = {}, 0
+        for record in records:
+            id = record["id"]
+            if id in batch and not replace:
+                skipped += 1
+                continue
+            if "messages" in record:
+                messages = [
+                    (message["role"], message["text"], message.get("created_at"))
+                    for message in record["messages"]
+                ]
+            else:
+                messages = [
+                    (role, text, None)
+                    for role, text in splitTranscript(record.get("content") or "")
+                ]
+            batch[id] = (record.get("title", ""), messages)
+            size += len(messages) + 1
+            if size >= batchSize:
+                count = len(batch)
+                added = self.importBatch(batch, replace)
+                imported += added
+                skipped += count - added
+                batch, size = {}, 0
+        if batch:
+            count = len(batch)
+            added = self.importBatch(batch, replace)
+            imported += added
+            skipped += count - added
+        return imported, skipped
+
+    def importBatch(self, batch, replace):
+        try:
+            return self.writeBatch(batch, replace)
+        finally:
+            if self.fullTextIndex:
+                # also after a failed batch, so that messages are never left unindexed
+                self.createFullTextIndex()
+
+    def writeBatch(self, batch, replace):
+        with self.transaction():
+            if not self.connection.in_transaction:
+                # sqlite3 only begins a transaction before DML; the trigger drops
+                # below must be part of it to be undone by a rollback
+                self.cursor.execute("BEGIN")
+            if not replace:
+                ids = list(batch)
+                # stay below the SQLite limit on bound parameters
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    self.cursor.execute(
+                        f"SELECT id FROM data WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                    )
+                    for (id,) in self.cursor.fetchall():
+                        del batch[id]
+            if not batch:
+                return 0
+            keys = [(id,) for id in batch]
+            if self.fullTextIndex:
+                # row by row the message triggers cost several times the writes
+                # themselves; the batch is indexed in one statement instead and the
+                # triggers are recreated below
+                for trigger in ("messages_ai", "messages_ad", "messages_au"):
+                    self.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                if replace:
+                    self.cursor.executemany(
+                        "INSERT INTO messages_fts (messages_fts, rowid, text) SELECT 'delete', rowid, text FROM messages WHERE conversation_id = ?",
+                        keys,
+                    )
+            if replace:
+                self.cursor.executemany("DELETE FROM messages WHERE conversation_id = ?", keys)
+            # without AUTOINCREMENT new rows are numbered from the current maximum up
+            self.cursor.execute("SELECT COALESCE(MAX(rowid), 0) FROM messages")
+            (lastRowid,) = self.cursor.fetchone()
+            self.cursor.executemany(
+                "INSERT INTO data (id, title) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET title = excluded.title WHERE title IS NOT excluded.title",
+                ((id, title) for id, (title, messages) in batch.items()),
+            )
+            self.cursor.executemany(
+                "INSERT INTO messages (conversation_id, seq, role, text, created_at) "
+                "VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+                (
+                    (id, seq, role, text, createdAt)
+                    for id, (title, messages) in batch.items()
+                    for seq, (role, text, createdAt) in enumerate(messages)
+                ),
+            )
+            if self.fullTextIndex:
+                self.cursor.execute(
+                    "INSERT INTO messages_fts (rowid, text) SELECT rowid, text FROM messages WHERE rowid > ?",
+                    (lastRowid,),
+                )
+                self.createFullTextIndex()
+            self.notify("imported", len(batch))
+        return len(batch)
+
+    def getContent(self, id):
+        self.cursor.execute(
+            "SELECT role, text FROM messages WHERE conversation_id = ? ORDER BY seq",
+            (id,),
+        )
+        return joinTranscript(self.cursor.fetchall())
+
+    def getMessages(self, id):
+        '''(role, text, tokens) of each message; counts missing since the last edit are filled in.'''
+        self.cursor.execute(
+            "SELECT seq, role, text, tokens FROM messages WHERE conversation_id = ? ORDER BY seq",
+            (id,),
+        )
+        rows = self.cursor.fetchall()
+        counted = [(countTokens(text), id, seq) for seq, role, text, tokens in rows if tokens is None]
+        if counted:
+            self.cursor.executemany(
+                "UPDATE messages SET tokens = ? WHERE conversation_id = ? AND seq = ?", counted
+            )
+            self.commit()
+            counts = iter(tokens for tokens, _, _ in counted)
+            rows = [(seq, role, text, next(counts) if tokens is None else tokens) for seq, role, text, tokens in rows]
+        return [row[1:] for row in rows]
+
+    def fullTextSearch(self, title, content, limit=-1):
+        '''Best matches first, as (id, title, highlighted snippet of the best message).'''
+        if not content:
+            self.cursor.execute(
+                "SELECT data.id, data.title, '' FROM data_fts JOIN data ON data.rowid = data_fts.rowid "
+                "WHERE data_fts MATCH ? ORDER BY rank LIMIT ?",
+                (title, limit),
+            )
+            return self.cursor.fetchall()
+        # the best scoring message ranks its conversation; the bare rowid
+        # beside MIN() is that message's
+        query = (
+            "SELECT data.id, data.title, best.rowid FROM (SELECT messages.conversation_id AS id, "
+            "messages_fts.rowid AS rowid, MIN(messages_fts.rank) AS score FROM messages_fts "
+            "JOIN messages ON messages.rowid = messages_fts.rowid WHERE messages_fts MATCH ? "
+            "GROUP BY messages.conversation_id) AS best JOIN data ON data.id = best.id"
+        )
+        parameters = (content,)
+        if title:
+            query += " WHERE data.rowid IN (SELECT rowid FROM data_fts WHERE data_fts MATCH ?)"
+            parameters += (title,)
+        query += " ORDER BY best.score LIMIT ?"
+        self.cursor.execute(query, parameters + (limit,))
+        rows = self.cursor.fetchall()
+        # snippets only for the messages shown, not for every hit
+        snippets = {}
+        for start in range(0, len(rows), 500):
+            rowids = [rowid for _, _, rowid in rows[start:start + 500]]
+            self.cursor.execute(
+                "SELECT rowid, snippet(messages_fts, 0, '[', ']', '...', 16) FROM messages_fts "
+                f"WHERE messages_fts MATCH ? AND rowid IN ({', '.join('?' * len(rowids))})",
+                [content] + rowids,
+            )
+            snippets.update(self.cursor.fetchall())
+        return [(id, title, snippets.get(rowid, "")) for id, title, rowid in rows]
+
+    def fullTextMatches(self, title, content):
+        '''(id, title) of the conversations matching both queries, unranked and without snippets.'''
+        conditions, parameters = [], []
+        if title:
+            # the title index is the smaller one; SQLite starts from it
+            conditions.append("rowid IN (SELECT rowid FROM data_fts WHERE data_fts MATCH ?)")
+            parameters.append(title)
+        if content:
+            conditions.append(
+                "id IN (SELECT messages.conversation_id FROM messages_fts JOIN messages "
+                "ON messages.rowid = messages_fts.rowid WHERE messages_fts MATCH ?)"
+            )
+            parameters.append(content)
+        self.cursor.execute(
+            "SELECT id, title FROM data WHERE " + " AND ".join(conditions), parameters
+        )
+        return self.cursor.fetchall()
+
+    def search(self, title, content):
+        '''
+        (id, title) of the conversations whose title and messages match.
+
+        With the full-text index, plain words are looked up in it as
+        described in fullTextQuery(); otherwise, and for any other input,
+        the rows are scanned with LIKE, or REGEXP if enabled.
+        '''
+        if not title and not content:
+            self.cursor.execute("SELECT id, title FROM data")
+            return self.cursor.fetchall()
+        if self.fullTextIndex and config.fullTextSearchEnabled:
+            queries = [fullTextQuery(text) if text else "" for text in (title, content)]
+            if None not in queries:
+                try:
+                    return self.fullTextMatches(*queries)
+                except sqlite3.OperationalError:
+                    # a query FTS5 rejects after all; scan instead
+                    pass
+        if config.regexpSearchEnabled:
+            operator, pattern = "REGEXP", "{}"
+        else:
+            operator, pattern = "LIKE", "%{}%"
+        conditions, parameters = [], []
+        if title:
+            conditions.append(f"title {operator} ?")
+            parameters.append(pattern.format(title))
+        if content:
+            conditions.append(
+                f"id IN (SELECT conversation_id FROM messages WHERE text {operator} ?)"
+            )
+            parameters.append(pattern.format(content))
+        self.cursor.execute(
+            "SELECT id, title FROM data WHERE " + " AND ".join(conditions), parameters
+        )
+        return self.cursor.fetchall()
+
+    def delete(self, *ids):
+        self.cursor.executemany(
+            "DELETE FROM messages WHERE conversation_id = ?", ((id,) for id in ids)
+        )
+        self.cursor.executemany("DELETE FROM data WHERE id = ?", ((id,) for id in ids))
+        self.notify("deleted", ids)
+        self.commit()
+
+    def clear(self):
+        self.cursor.execute("DELETE FROM messages")
+        self.cursor.execute("DELETE FROM data")
+        self.notify("cleared")
+        self.commit()
+
+
+class Request:
+    def __init__(self, name, args, future, keys):
+        self.name = name
+        self.args = args
+        self.futures = [future]
+        # conversations this request writes to
+        self.keys = keys
+        self.started = False
+
+
+class DatabaseService:
+    '''
+    Runs a Database on a thread of its own, with its own connection.
+
+    submit(name, *args) queues a call to the Database method of that name
+    and returns a concurrent.futures.Future for its result. Calls run one
+    at a time in the order they were submitted, so writes to a conversation
+    are never reordered. A full save (insert) of a conversation that is
+    still waiting in the queue takes the newer transcript instead of
+    queueing again, as long as nothing else for that conversation was
+    queued after it.
+
+    Listeners get the Database change notifications, on the service thread.
+    '''
+
+    def __init__(self, filePath=""):
+        self.filePath = filePath if filePath else defaultFilePath()
+        self.listeners = []
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # conversation id -> the last write queued for it
+        self.lastWrite = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, name, *args):
+        future = Future()
+        if name in ("insert", "appendMessage"):
+            keys = (args[0],)
+        elif name == "delete":
+            keys = args
+        else:
+            keys = ()
+        with self.lock:
+            if name == "insert":
+                last = self.lastWrite.get(args[0])
+                if last is not None and last.name == "insert" and not last.started:
+                    last.args = args
+                    last.futures.append(future)
+                    return future
+            if name == "clear":
+                self.lastWrite.clear()
+            request = Request(name, args, future, keys)
+            for key in keys:
+                self.lastWrite[key] = request
+            self.queue.put(request)
+        return future
+
+    def changed(self, *change):
+        for listener in self.listeners:
+            listener(*change)
+
+    def run(self):
+        # the connection is opened here, so it is only ever used by this thread
+        try:
+            database = Database(self.filePath)
+        except Exception as error:
+            database, openError = None, error
+        else:
+            database.listeners.append(self.changed)
+        while True:
+            request = self.queue.get()
+            if request is None:
+                break
+            with self.lock:
+                request.started = True
+                for key in request.keys:
+                    if self.lastWrite.get(key) is request:
+                        del self.lastWrite[key]
+            futures = [future for future in request.futures if future.set_running_or_notify_cancel()]
+            try:
+                if database is None:
+                    raise openError
+                result = getattr(database, request.name)(*request.args)
+            except Exception as error:
+                for future in futures:
+                    future.set_exception(error)
+            else:
+                for future in futures:
+                    future.set_result(result)
+        if database is not None:
+            database.close()
+
+    def close(self):
+        # queued writes are finished before the connection closes
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,45 @@
+import config, sys, traceback
+
+if config.qtLibrary == "pyside6":
+    from PySide6.QtCore import Qt, Slot, Signal, QObject
+else:
+    from qtpy.QtCore import Qt, Slot, Signal, QObject
+
+
+class FutureSignals(QObject):
+    '''
+    Brings work done on other threads back to the GUI thread.
+
+    Create it on the GUI thread. call(fn, *args) may be used from any thread
+    and runs fn on the GUI thread; then(future, callback) passes the result
+    of a concurrent.futures.Future to callback on the GUI thread. A failed
+    future is reported through error instead.
+    '''
+    called = Signal(object, object)
+    error = Signal(tuple)
+
+    def __init__(self, parent=None):
+        super(FutureSignals, self).__init__(parent)
+        # queued, since emit happens on the thread that finished the work
+        self.called.connect(self.dispatch, Qt.QueuedConnection)
+
+    @Slot(object, object)
+    def dispatch(self, fn, args):
+        fn(*args)
+
+    def call(self, fn, *args):
+        self.called.emit(fn, args)
+
+    def then(self, future, callback):
+        def done(future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None:
+                self.call(callback, future.result())
+            else:
+                trace = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+                print(trace, file=sys.stderr)
+                self.error.emit((type(error), error, trace))
+        future.add_done_callback(done)
+        return future
@@ -0,0 +1,125 @@
+import config
+from api.latency import latency, RequestTiming
+from api.resilience import metrics
+
+if config.qtLibrary == "pyside6":
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import (
+        QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget,
+        QTableWidgetItem, QHeaderView, QFileDialog,
+    )
+else:
+    from qtpy.QtCore import QTimer
+    from qtpy.QtWidgets import (
+        QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget,
+        QTableWidgetItem, QHeaderView, QFileDialog,
+    )
+
+
+class LatencyPanel(QWidget):
+    '''
+    Developer view of api.latency: p50, p95 and p99 of every request
+    phase per backend, refreshed every second while the panel is shown.
+
+    A slow ttfb with quick connect and tls points at the upstream; a long
+    queueWait at our own thread pool or rate limits.
+    '''
+    columns = ("backend", "phase", "count", "p50 ms", "p95 ms", "p99 ms")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.logFile = ""
+        self.setupUI()
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def setupUI(self):
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+        self.summary = QLabel()
+        self.summary.setWordWrap(True)
+        layout.addWidget(self.summary)
+        buttons = QHBoxLayout()
+        exportButton = QPushButton(config.thisTranslation["exportMetrics"])
+        exportButton.clicked.connect(self.exportMetrics)
+        buttons.addWidget(exportButton)
+        self.logButton = QPushButton(config.thisTranslation["startLatencyLog"])
+        self.logButton.clicked.connect(self.toggleLog)
+        buttons.addWidget(self.logButton)
+        layout.addLayout(buttons)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = latency.snapshot()
+        rows = [
+            (backend, phase, entry[phase])
+            for backend, entry in sorted(snapshot.items())
+            for phase in RequestTiming.phases
+            if phase in entry
+        ]
+        self.table.setRowCount(len(rows))
+        for row, (backend, phase, histogram) in enumerate(rows):
+            values = [backend, phase, str(histogram["count"])]
+            values += [f"{histogram[q] * 1000:.1f}" for q in ("p50", "p95", "p99")]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        lines = []
+        for backend, entry in sorted(snapshot.items()):
+            outcomes = ", ".join(f"{outcome} {count}" for outcome, count in sorted(entry["outcomes"].items()))
+            lines.append(f"{backend}: {entry['requests']} requests ({outcomes}), {entry['bytes']} bytes received")
+        counters = metrics.snapshot()
+        if counters:
+            lines.append(", ".join(f"{name} {value:g}" for name, value in sorted(counters.items())))
+        if self.logFile:
+            lines.append(f"Logging to {self.logFile}")
+        self.summary.setText("\n".join(lines))
+
+    def exportMetrics(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        (filePath, _) = QFileDialog.getSaveFileName(
+            self,
+            config.thisTranslation["exportMetrics"],
+            "latency.prom",
+            "Prometheus Text Files (*.prom)",
+            options=options,
+        )
+        if filePath:
+            latency.writePrometheus(filePath)
+
+    def toggleLog(self):
+        if self.logFile:
+            latency.closeLog()
+            self.logFile = ""
+            self.logButton.setText(config.thisTranslation["startLatencyLog"])
+        else:
+            options = QFileDialog.Options()
+            options |= QFileDialog.DontUseNativeDialog
+            (filePath, _) = QFileDialog.getSaveFileName(
+                self,
+                config.thisTranslation["startLatencyLog"],
+                "latency.jsonl",
+                "JSON Lines Files (*.jsonl)",
+                options=options,
+            )
+            if not filePath:
+                return
+            latency.openLog(filePath)
+            self.logFile = filePath
+            self.logButton.setText(config.thisTranslation["stopLatencyLog"])
+        self.refresh()
@@ -0,0 +1,32 @@
+import ctypes
+import sys
+
+try:
+    from PySide6 import __version_info__ as pysideVersion
+except ImportError:
+    pysideVersion = ()
+
+# PySide6 6.12 drops a reference to None on every call of a Qt method that
+# returns void, and one to True on every signal queued across threads.
+# Before Python 3.12 neither object is immortal, so after a few thousand
+# calls the count reaches zero and the interpreter aborts with "Fatal
+# Python error: none_dealloc". reserve holds spare references to keep the
+# counts up; topUp() refills it as the binding uses them.
+affected = sys.version_info < (3, 12) and tuple(pysideVersion[:2]) == (6, 12)
+reserve = []
+if affected:
+    # never freed, not even at exit, where letting go of the spares would
+    # bring the counts down to zero after all
+    ctypes.pythonapi.Py_IncRef(ctypes.py_object(reserve))
+
+
+def topUp(minimum=100000):
+    '''Keep at least minimum references to None, True and False; cheap when there are.'''
+    if not affected:
+        return
+    for obj in (None, True, False):
+        if sys.getrefcount(obj) < minimum:
+            reserve.extend([obj] * minimum)
+
+
+topUp()
@@ -0,0 +1,201 @@
+import ast
+import json
+import os
+import sqlite3
+import threading
+import types
+
+
+class TrackedModule(types.ModuleType):
+    # lets Settings see every config.name = value made during the session
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        settings = self.__dict__.get("__settings__")
+        if settings is not None:
+            settings.changed(name)
+
+
+class Settings:
+    '''
+    Keeps the attributes of the config module in a SQLite file.
+
+    load() sets the stored values on config without executing any code.
+    After track(), every assignment to a config attribute is encoded right
+    away, on the thread that made it, and one flusher thread writes the
+    pending values in one transaction once no further change arrives for
+    delay seconds. It never reads config itself, so objects the GUI keeps
+    changing are not read halfway. flush(sweep=True), called from the
+    owning thread, also catches values that were changed in place, such as
+    an item added to a dict.
+
+    :param filePath: settings database
+    :param delay: seconds to wait for more changes before writing
+    '''
+    # objects living only as long as the session; never stored
+    transient = (
+        "mainWindow",
+        "chatGPTApi",
+        "chatGPTTransformers",
+        "predefinedContext",
+        "predefinedContexts",
+        "inputSuggestions",
+    )
+
+    def __init__(self, filePath, delay=1.0):
+        self.filePath = filePath
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filePath, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self.connection.commit()
+        self.config = None
+        # key -> JSON taken when it was assigned, not yet written
+        self.pending = {}
+        # key -> JSON as last loaded or written, to skip writes that change nothing
+        self.saved = {}
+        self.wake = threading.Event()
+        self.closing = False
+        self.flusher = None
+
+    def isEmpty(self):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM settings LIMIT 1").fetchone() is None
+
+    def migrate(self, filePath):
+        '''
+        Move the settings of an old config.py into the store, once.
+
+        The file is parsed, not executed; assignments of anything but plain
+        literals are reported and left out. The original is kept as
+        config.py.bak; a file that cannot be parsed stays where it is.
+        '''
+        if not os.path.isfile(filePath) or not self.isEmpty():
+            return
+        with open(filePath, "r", encoding="utf-8") as fileObj:
+            source = fileObj.read()
+        if not source.strip():
+            return
+        try:
+            body = ast.parse(source).body
+        except (ValueError, SyntaxError, MemoryError, RecursionError) as error:
+            print(f"{filePath} could not be read ({error}); it is kept and nothing was migrated.")
+            return
+        values = {}
+        for node in body:
+            if not (
+                isinstance(node, ast.Assign)
+                and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+            ):
+                continue
+            name = node.targets[0].id
+            if not self.persistent(name):
+                continue
+            try:
+                values[name] = ast.literal_eval(node.value)
+            except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                print(f"Setting {name} in {filePath} is not a literal; it was not migrated.")
+        self.write(values)
+        os.replace(filePath, filePath + ".bak")
+
+    def load(self, config):
+        with self.lock:
+            rows = self.connection.execute("SELECT key, value FROM settings").fetchall()
+        for key, value in rows:
+            setattr(config, key, json.loads(value))
+            self.saved[key] = value
+
+    def track(self, config):
+        # call after the defaults are in place; they are the baseline, not changes
+        self.config = config
+        for name, value in vars(config).items():
+            if self.persistent(name) and name not in self.saved:
+                encoded = self.encode(value)
+                if encoded is not None:
+                    self.saved[name] = encoded
+        config.__class__ = TrackedModule
+        config.__settings__ = self
+
+    def persistent(self, name):
+        return not name.startswith("_") and name not in self.transient
+
+    def encode(self, value):
+        # None for what JSON cannot hold, such as functions and widgets
+        if isinstance(value, (types.ModuleType, types.FunctionType, type)):
+            return None
+        try:
+            return json.dumps(value, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+    def changed(self, name):
+        if not self.persistent(name):
+            return
+        encoded = self.encode(getattr(self.config, name, None))
+        if encoded is None:
+            return
+        with self.lock:
+            self.pending[name] = encoded
+            if self.flusher is None and not self.closing:
+                self.flusher = threading.Thread(target=self.runFlusher, name="settings", daemon=True)
+                self.flusher.start()
+        self.wake.set()
+
+    def runFlusher(self):
+        while not self.closing:
+            self.wake.wait()
+            self.wake.clear()
+            # written once no further change arrives for delay seconds
+            while not self.closing and self.wake.wait(self.delay):
+                self.wake.clear()
+            self.flush()
+
+    def flush(self, sweep=False):
+        with self.lock:
+            rows, self.pending = self.pending, {}
+        if sweep and self.config is not None:
+            for name, value in list(vars(self.config).items()):
+                if self.persistent(name):
+                    encoded = self.encode(value)
+                    if encoded is not None:
+                        rows[name] = encoded
+        self.writeEncoded(rows)
+
+    def write(self, values):
+        encoded = {name: self.encode(value) for name, value in values.items()}
+        self.writeEncoded({name: value for name, value in encoded.items() if value is not None})
+
+    def writeEncoded(self, values):
+        with self.lock:
+            rows = [(name, value) for name, value in values.items() if self.saved.get(name) != value]
+            if not rows:
+                return
+            # one transaction: a crash leaves either all of these keys or none
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO settings (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    rows,
+                )
+            self.saved.update(rows)
+
+    def untrack(self):
+        # later assignments are no longer recorded, e.g. for a benchmark
+        # that changes settings only for its own run
+        if self.config is not None:
+            self.config.__dict__["__settings__"] = None
+
+    def close(self):
+        # call from the thread that owns config, e.g. the GUI thread at exit
+        with self.lock:
+            self.closing = True
+            flusher = self.flusher
+        self.wake.set()
+        if flusher is not None:
+            flusher.join()
+        self.flush(sweep=True)
+        self.untrack()
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,51 @@
+import time
+
+
+class StartupTimer:
+    '''
+    Records how long each phase of application start takes.
+
+    mark(name) ends a phase; only the first mark of a name counts.
+    whenDone(names, fn) calls fn once every one of names has been marked.
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []
+        self.pending = set()
+        self.done = None
+
+    def mark(self, name):
+        if name in (phase for phase, _ in self.phases):
+            return
+        self.phases.append((name, time.perf_counter()))
+        if name in self.pending:
+            self.pending.discard(name)
+            if not self.pending and self.done is not None:
+                done, self.done = self.done, None
+                done()
+
+    def whenDone(self, names, fn):
+        self.pending = set(names) - {phase for phase, _ in self.phases}
+        if self.pending:
+            self.done = fn
+        else:
+            fn()
+
+    def report(self):
+        lines = [f"{'phase':<24}{'took':>10}{'since start':>14}"]
+        previous = self.start
+        for name, end in self.phases:
+            lines.append(
+                f"{name:<24}{(end - previous) * 1000:>8.1f}ms{(end - self.start) * 1000:>12.1f}ms"
+            )
+            previous = end
+        return "\n".join(lines)
+
+    def write(self, filePath):
+        with open(filePath, "w", encoding="utf-8") as fileObj:
+            fileObj.write(self.report() + "\n")
+
+
+# created by the first import, so QChatGpt.py imports this module before anything else
+startupTimer = StartupTimer()
@@ -0,0 +1,23 @@
+encoding = None
+
+
+def getEncoding():
+    # tiktoken is optional; False once it turned out to be unavailable
+    global encoding
+    if encoding is None:
+        try:
+            import tiktoken
+
+            encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            encoding = False
+    return encoding
+
+
+def countTokens(text):
+    if getEncoding():
+        return len(encoding.encode(text))
+    # without tiktoken: about four characters per token for ASCII text,
+    # one per character for everything else, e.g. Chinese
+    ascii = len(text.encode("ascii", "ignore"))
+    return (ascii + 3) // 4 + len(text) - ascii
@@ -0,0 +1,92 @@
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+from urllib.request import pathname2url
+
+
+def openStream(filePath, mode):
+    '''
+    Open a JSONL file as text for "r" or "w".
+
+    A name ending in .gz is gzip compressed NDJSON; "-" is stdin or stdout.
+    '''
+    if filePath == "-":
+        stream = sys.stdin.buffer if mode == "r" else sys.stdout.buffer
+        return io.TextIOWrapper(stream, encoding="utf-8", newline="\n")
+    if filePath.endswith(".gz"):
+        # level 6 compresses nearly as well as 9 at a fraction of the time
+        return gzip.open(filePath, mode + "t", compresslevel=6, encoding="utf-8", newline="\n")
+    return open(filePath, mode, encoding="utf-8", newline="\n")
+
+
+def readDatabase(filePath):
+    '''
+    Yield the conversations of a .chat file without changing it.
+
+    The file is opened read-only and not migrated, so a database of any
+    schema version can be read; version 0 keeps whole transcripts in
+    data.content, which are passed on as content.
+    '''
+    if not os.path.isfile(filePath):
+        raise FileNotFoundError(f"No such database: {filePath}")
+    connection = sqlite3.connect(f"file:{pathname2url(os.path.abspath(filePath))}?mode=ro", uri=True)
+    try:
+        cursor = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'")
+        if cursor.fetchone() is None:
+            cursor = connection.execute("SELECT id, title, content, NULL, NULL, NULL FROM data ORDER BY id")
+        else:
+            cursor = connection.execute(
+                "SELECT data.id, data.title, data.content, messages.role, messages.text, messages.created_at "
+                "FROM data LEFT JOIN messages ON messages.conversation_id = data.id "
+                "ORDER BY data.id, messages.seq"
+            )
+        record = None
+        for id, title, content, role, text, createdAt in cursor:
+            if record is None or record["id"] != id:
+                if record is not None:
+                    yield record
+                if content:
+                    # a transcript not yet split into messages
+                    record = {"id": id, "title": title, "content": content}
+                else:
+                    record = {"id": id, "title": title, "messages": []}
+            if role is not None and "messages" in record:
+                record["messages"].append({"role": role, "text": text, "created_at": createdAt})
+        if record is not None:
+            yield record
+    finally:
+        connection.close()
+
+
+def readRecords(filePath):
+    # a .chat file is read directly, so databases can be merged without a dump in between
+    if filePath.endswith(".chat"):
+        yield from readDatabase(filePath)
+        return
+    with openStream(filePath, "r") as fileObj:
+        for line in fileObj:
+            if line.strip():
+                yield json.loads(line)
+
+
+def exportDatabase(database, filePath):
+    '''Write every conversation of database to filePath, one JSON object per line; returns the count.'''
+    count = 0
+    with openStream(filePath, "w") as fileObj:
+        for record in database.exportRecords():
+            fileObj.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            fileObj.write("\n")
+            count += 1
+    return count
+
+
+def importFiles(database, filePaths, replace=False, batchSize=20000):
+    '''Import JSONL, NDJSON .gz or .chat files into database; returns (imported, skipped).'''
+    def records():
+        for filePath in filePaths:
+            yield from readRecords(filePath)
+
+    return database.importRecords(records(), replace, batchSize)
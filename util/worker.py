@@ -1,10 +1,104 @@
-import config, sys, traceback, openai, os
-from api.api import chat
+import config, sys, time, traceback, threading
+from api.api import CancelToken
+from api.latency import RequestTiming, setQueueWait
+from api.resilience import CircuitOpenError, RETRYABLE_STATUS, parseRetryAfter
+from util.backend import getRetryPolicy, getImageLimiter, getAnswer
+from util.batch import runBatch
 
 if config.qtLibrary == "pyside6":
-    from PySide6.QtCore import QRunnable, Slot, Signal, QObject, QThreadPool
+    from PySide6.QtCore import QRunnable, Slot, Signal, QObject, QThreadPool, QTimer
 else:
-    from qtpy.QtCore import QRunnable, Slot, Signal, QObject, QThreadPool
+    from qtpy.QtCore import QRunnable, Slot, Signal, QObject, QThreadPool, QTimer
+
+
+def classifyOpenAIError(error):
+    import openai
+    if isinstance(error, (openai.error.RateLimitError, openai.error.APIConnectionError,
+                          openai.error.Timeout, openai.error.ServiceUnavailableError)):
+        retryable = True
+    else:
+        retryable = (
+            isinstance(error, openai.error.APIError)
+            and error.http_status in RETRYABLE_STATUS
+        )
+    headers = getattr(error, "headers", None) or {}
+    return retryable, parseRetryAfter(headers.get("Retry-After"))
+
+
+def getOpenAIOutcome(error):
+    # outcome label of a failed image request for api.latency
+    import openai
+    if isinstance(error, openai.error.Timeout):
+        return "timeout"
+    if isinstance(error, openai.error.APIConnectionError):
+        return "connection"
+    status = getattr(error, "http_status", None)
+    return f"http_{status}" if status else "error"
+
+
+imageRetryPolicy = None
+
+
+def getImageRetryPolicy():
+    global imageRetryPolicy
+    if imageRetryPolicy is None:
+        imageRetryPolicy = getRetryPolicy("image", classifyOpenAIError)
+    return imageRetryPolicy
+
+
+# QThreadPool runs higher priorities first
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BACKGROUND = 0
+
+
+class Scheduler:
+    '''
+    Application wide, bounded pool for every Worker.
+
+    Interactive prompts are started with a higher priority than background
+    jobs, so they skip ahead of queued image generation or batch runs.
+
+    :param maxThreadCount: maximum number of workers running at once
+    '''
+
+    def __init__(self, maxThreadCount):
+        self.threadpool = QThreadPool()
+        self.threadpool.setMaxThreadCount(maxThreadCount)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+
+    def start(self, worker, priority=PRIORITY_INTERACTIVE):
+        with self.lock:
+            self.queued += 1
+        worker.scheduler = self
+        worker.queuedAt = time.perf_counter()
+        self.threadpool.start(worker, priority)
+
+    def workerStarted(self):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+
+    def workerFinished(self):
+        with self.lock:
+            self.running -= 1
+
+    def queueDepth(self):
+        return self.queued
+
+    def inFlight(self):
+        return self.running
+
+
+scheduler = None
+
+
+def getScheduler():
+    global scheduler
+    if scheduler is None:
+        scheduler = Scheduler(config.maximumWorkerThreads)
+    return scheduler
 
 
 class WorkerSignals(QObject):
@@ -23,13 +117,17 @@ class WorkerSignals(QObject):
         object data returned from processing, anything
 
     progress
-        int indicating % progress
+        str chunk of streamed output, or the status of a batch
+
+    partial
+        object one result of a batch, as soon as it is ready
 
     '''
     finished = Signal()
     error = Signal(tuple)
     result = Signal(object)
     progress = Signal(str)
+    partial = Signal(object)
 
 
 class Worker(QRunnable):
@@ -44,6 +142,9 @@ class Worker(QRunnable):
     :param args: Arguments to pass to the callback function
     :param kwargs: Keywords to pass to the callback function
 
+    The callback also receives ``progress_callback`` and ``cancel_token``;
+    call cancel() to abort the request it is running.
+
     '''
 
     def __init__(self, fn, *args, **kwargs):
@@ -54,9 +155,16 @@ class Worker(QRunnable):
         self.args = args
         self.kwargs = kwargs
         self.signals = WorkerSignals()
+        self.scheduler = None
+        self.queuedAt = None
+        self.cancelToken = CancelToken()
 
         # Add the callback to our kwargs
         self.kwargs["progress_callback"] = self.signals.progress
+        self.kwargs["cancel_token"] = self.cancelToken
+
+    def cancel(self):
+        self.cancelToken.cancel()
 
     @Slot()
     def run(self):
@@ -67,6 +175,11 @@ class Worker(QRunnable):
         # assign a reference to this current thread
         #config.workerThread = QThread.currentThread()
 
+        if self.scheduler is not None:
+            self.scheduler.workerStarted()
+        if self.queuedAt is not None:
+            # the request this worker makes reports it as its queue wait
+            setQueueWait(time.perf_counter() - self.queuedAt)
         # Retrieve args/kwargs here; and fire processing using them
         try:
             result = self.fn(*self.args, **self.kwargs)
@@ -77,28 +190,119 @@ class Worker(QRunnable):
         else:
             self.signals.result.emit(result)  # Return the result of the processing
         finally:
+            setQueueWait(None)
+            if self.scheduler is not None:
+                self.scheduler.workerFinished()
             self.signals.finished.emit()  # Done
 
 
+class StreamBuffer(QObject):
+    '''
+    Merges streamed chunks into frame sized batches for the widget.
+
+    Chunks given to append are held until the interval elapses or maxSize
+    characters are pending, then emitted together through flushed. Call
+    flush when the stream ends so that nothing is left behind.
+    '''
+    flushed = Signal(str)
+
+    def __init__(self, interval=16, maxSize=4096, parent=None):
+        super(StreamBuffer, self).__init__(parent)
+        self.chunks = []
+        self.size = 0
+        self.maxSize = maxSize
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    @Slot(str)
+    def append(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.maxSize:
+            self.flush()
+        elif not self.timer.isActive():
+            self.timer.start()
+
+    @Slot()
+    def flush(self):
+        self.timer.stop()
+        if self.chunks:
+            text = "".join(self.chunks)
+            self.chunks = []
+            self.size = 0
+            self.flushed.emit(text)
+
+
 class ChatGPTResponse:
 
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
-        self.threadpool = QThreadPool()
 
-    def getResponse(self, messages, progress_callback):
-        return chat(messages)
+    def getResponse(self, messages, context, progress_callback, cancel_token):
+        return getAnswer(messages, context, cancel_token, progress_callback.emit)
 
     def workOnGetResponse(self, messages):
         # Pass the function to execute
-        worker = Worker(self.getResponse, messages) # Any other args, kwargs are passed to the run function
+        worker = Worker(self.getResponse, messages, self.parent.getContext()) # Any other args, kwargs are passed to the run function
+        buffer = StreamBuffer(
+            config.chatGPTApiStreamInterval, config.chatGPTApiStreamBufferSize, self.parent
+        )
+        worker.signals.progress.connect(buffer.append)
+        buffer.flushed.connect(self.parent.printStream)
+        # pending text reaches the widget before the final answer replaces it
+        worker.signals.result.connect(buffer.flush)
         worker.signals.result.connect(self.parent.processResponse)
-        worker.signals.progress.connect(self.parent.printStream)
+        worker.signals.error.connect(self.parent.processError)
+        worker.signals.finished.connect(buffer.flush)
+        worker.signals.finished.connect(buffer.deleteLater)
         # Connection
         #worker.signals.finished.connect(None)
         # Execute
-        self.threadpool.start(worker)
+        getScheduler().start(worker, PRIORITY_INTERACTIVE)
+        return worker
+
+
+class ChatGPTBatch:
+    '''
+    Runs a batch of prompts on a background worker.
+
+    Each result dict of util.batch.runBatch reaches onResult on the GUI
+    thread; onProgress gets a status line with throughput and ETA after
+    every result, and onFinished the number of results.
+    '''
+
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+
+    def getResponses(self, prompts, ordered, parallel, progress_callback, cancel_token, partial_callback):
+        count = 0
+        for result in runBatch(
+            prompts,
+            self.parent.getContext(),
+            parallel,
+            ordered,
+            cancel_token,
+            lambda progress: progress_callback.emit(str(progress)),
+        ):
+            partial_callback.emit(result)
+            count += 1
+        return count
+
+    def workOnGetResponses(self, prompts, onResult, onProgress=None, onFinished=None, ordered=True, parallel=None):
+        worker = Worker(self.getResponses, prompts, ordered, parallel)
+        worker.kwargs["partial_callback"] = worker.signals.partial
+        worker.signals.partial.connect(onResult)
+        if onProgress is not None:
+            worker.signals.progress.connect(onProgress)
+        if onFinished is not None:
+            worker.signals.result.connect(onFinished)
+        # behind interactive prompts, which should not wait for a whole batch
+        getScheduler().start(worker, PRIORITY_BACKGROUND)
+        return worker
 
 
 class OpenAIImage:
@@ -106,17 +310,36 @@ class OpenAIImage:
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
-        self.threadpool = QThreadPool()
 
-    def getResponse(self, prompt):
+    def createImage(self, prompt, cancelToken=None):
+        # openai takes longer to import than the rest of the app; load it on first use
+        import openai
+        if not getImageLimiter().acquire(1, cancelToken):
+            return ""
+        # openai hides its connection, so only the total and the outcome are known
+        timing = RequestTiming("image")
+        #https://platform.openai.com/docs/guides/images/introduction
         try:
-            #https://platform.openai.com/docs/guides/images/introduction
             response = openai.Image.create(
                 prompt=prompt,
                 n=1,
                 size="1024x1024",
             )
-            return response['data'][0]['url']
+        except Exception as error:
+            timing.finish(getOpenAIOutcome(error))
+            raise
+        timing.finish("ok")
+        return response['data'][0]['url']
+
+    def getResponse(self, prompt, progress_callback, cancel_token):
+        import openai
+        try:
+            # retryable errors only reach the handlers below once retries are used up
+            return getImageRetryPolicy().call(
+                self.createImage, prompt, cancel_token, cancelToken=cancel_token
+            )
+        except CircuitOpenError as e:
+            print(e)
         # error codes: https://platform.openai.com/docs/guides/error-codes/python-library-error-types
         except openai.error.APIError as e:
             #Handle API error here, e.g. retry or log
@@ -125,7 +348,7 @@ class OpenAIImage:
             #Handle connection error here
             print(f"Failed to connect to OpenAI API: {e}")
         except openai.error.RateLimitError as e:
-            #Handle rate limit error (we recommend using exponential backoff)
+            #Handle rate limit error (already retried with exponential backoff)
             print(f"OpenAI API request exceeded rate limit: {e}")
         except:
             traceback.print_exc()
@@ -138,4 +361,5 @@ class OpenAIImage:
         # Connection
         #worker.signals.finished.connect(None)
         # Execute
-        self.threadpool.start(worker)
+        getScheduler().start(worker, PRIORITY_BACKGROUND)
+        return worker